@@ -0,0 +1,147 @@
+import math
+import os
+import threading
+import time
+
+import metrics
+import pool
+import sessions
+from main import Database, Windows
+
+
+DEFAULTS = {
+    'limit': int(os.environ.get('ADMISSION_LIMIT', 8)),
+    'queue': int(os.environ.get('ADMISSION_QUEUE', 32)),
+    'wait': float(os.environ.get('ADMISSION_WAIT', 5)),
+}
+
+
+class Rejected(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Gate:
+    # at most `limit` requests at once against one target, up to `queue`
+    # more waiting in line for at most `wait` seconds each
+    def __init__(self, backend, host, limit=8, queue=32, wait=5):
+        if limit < 1 or queue < 0:
+            raise ValueError(f"invalid admission limits: limit={limit} queue={queue}")
+        self.backend = backend
+        self.host = host
+        self.limit = limit
+        self.queue = queue
+        self.wait = wait
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        # moving average of how long an admitted request holds its slot
+        self.hold = 0.0
+        self.condition = threading.Condition()
+
+    def expected_wait(self):
+        # caller holds the lock
+        return self.hold * (self.waiting + 1) / self.limit
+
+    def retry_after(self):
+        return max(1, math.ceil(self.expected_wait()))
+
+    def enter(self, slots=1, wait=None):
+        # blocks until `slots` are free, raising Rejected straight away when
+        # the line is full or clearly too long and after `wait` seconds otherwise
+        slots = min(max(slots, 1), self.limit)
+        wait = self.wait if wait is None else wait
+        started = time.monotonic()
+        with self.condition:
+            if self.active + slots > self.limit or self.waiting:
+                if self.waiting >= self.queue or self.expected_wait() > wait:
+                    self.rejected += 1
+                    raise Rejected(f"too many requests for {self.host} ({self.active} running, {self.waiting} waiting)",
+                                   self.retry_after())
+                self.waiting += 1
+                try:
+                    deadline = started + wait
+                    while self.active + slots > self.limit:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.rejected += 1
+                            raise Rejected(f"timed out after {wait}s waiting for {self.host}", self.retry_after())
+                        self.condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.active += slots
+            self.admitted += 1
+        entered = time.monotonic()
+        metrics.registry.observe('admission_wait', self.backend, self.host, entered - started)
+        return entered, slots
+
+    def leave(self, ticket):
+        entered, slots = ticket
+        held = time.monotonic() - entered
+        with self.condition:
+            self.active -= slots
+            self.hold = held if not self.hold else self.hold * 0.8 + held * 0.2
+            self.condition.notify_all()
+
+
+_gates = {}
+_lock = threading.Lock()
+
+
+def gate(backend, host, port, **options):
+    # per target, whoever the user: the limits protect the server
+    key = (str(backend).lower(), host, int(port))
+    with _lock:
+        existing = _gates.get(key)
+        if existing is None:
+            existing = _gates[key] = Gate(backend, host, **dict(DEFAULTS, **options))
+    return existing
+
+
+def capacity(client):
+    # admitting more requests than the target has connections (or WinRM
+    # shells) only moves the wait into pool.acquire or take_shell, which
+    # answer much later than a 429 and without a retry hint
+    if isinstance(client, Database):
+        existing = pool.pools().get((client.key(), pool.fingerprint(client.password)))
+        return existing.max_size if existing is not None else pool.DEFAULTS['max_size']
+    if isinstance(client, Windows):
+        return sessions.wsman.max_shells
+    return DEFAULTS['limit']
+
+
+def gate_for(client, entry=None):
+    settings = {'limit': min(DEFAULTS['limit'], capacity(client))}
+    settings.update(options(entry or {}))
+    return gate(client.type, client.host, client.port, **settings)
+
+
+def options(entry):
+    # per-target overrides from a registry or inventory entry
+    fields = {'max_concurrency': 'limit', 'max_queue': 'queue', 'max_wait': 'wait'}
+    return {option: type(DEFAULTS[option])(entry[field]) for field, option in fields.items()
+            if entry.get(field) not in (None, '')}
+
+
+def gates():
+    with _lock:
+        return dict(_gates)
+
+
+def metrics_lines():
+    lines = ['# TYPE admission_requests gauge']
+    counters = ['# TYPE admission_total counter']
+    for (backend, host, port), entry in sorted(gates().items()):
+        labels = f'backend="{metrics.escape(backend)}",host="{metrics.escape(host)}",port="{port}"'
+        with entry.condition:
+            active, waiting, admitted, rejected = entry.active, entry.waiting, entry.admitted, entry.rejected
+        lines.append(f'admission_requests{{{labels},state="active"}} {active}')
+        lines.append(f'admission_requests{{{labels},state="waiting"}} {waiting}')
+        counters.append(f'admission_total{{{labels},outcome="admitted"}} {admitted}')
+        counters.append(f'admission_total{{{labels},outcome="rejected"}} {rejected}')
+    return lines + counters
+
+
+metrics.registry.collectors.append(metrics_lines)
@@ -0,0 +1,151 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+import drivers
+import main
+
+
+executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix='aio')
+
+
+class AsyncBase:
+    def __init__(self, client):
+        self.client = client
+
+    async def connect(self):
+        raise ValueError
+
+    async def run(self, raw_input):
+        raise ValueError
+
+    async def close(self):
+        pass
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+class ExecutorClient(AsyncBase):
+    # runs the blocking client on a bounded thread pool, borrowing from the
+    # same connection pools and session caches as the synchronous code
+    def __init__(self, client, executor=executor):
+        super().__init__(client)
+        self.executor = executor
+        self.stack = None
+        self.connection = None
+        self.running = None
+
+    async def call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def borrow(self):
+        stack = ExitStack()
+        connection = stack.enter_context(self.client.borrow())
+        return stack, connection
+
+    async def connect(self):
+        future = self.executor.submit(self.borrow)
+        try:
+            self.stack, self.connection = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # a borrow that completes after the caller gave up is handed back
+            future.add_done_callback(give_back)
+            raise
+
+    async def run(self, raw_input):
+        # the thread keeps running after a cancelled await, so the call is
+        # kept to know when the connection is free again
+        self.running = self.executor.submit(self.connection.run, raw_input)
+        return await asyncio.wrap_future(self.running)
+
+    async def close(self):
+        stack, self.stack, self.connection = self.stack, None, None
+        running, self.running = self.running, None
+        if stack is None:
+            return
+        if running is not None and not running.done():
+            # still in use on the executor thread (timed out or cancelled):
+            # back to the pool only once that call has returned
+            running.add_done_callback(lambda _: stack.close())
+            return
+        await self.call(stack.close)
+
+
+def give_back(future):
+    if not future.cancelled() and future.exception() is None:
+        stack, _ = future.result()
+        stack.close()
+
+
+class AsyncMysql(AsyncBase):
+    async def connect(self):
+        client = self.client
+        aiomysql = drivers.load('aiomysql')
+        self.connection = await aiomysql.connect(host=client.host, port=client.port, user=client.user, password=client.password)
+
+    async def run(self, raw_input):
+        async with self.connection.cursor() as cursor:
+            await cursor.execute(raw_input)
+            raw_results = await cursor.fetchall()
+            column_names = [desc[0] for desc in cursor.description]
+        return column_names, raw_results
+
+    async def close(self):
+        self.connection.close()
+
+
+class AsyncLinux(AsyncBase):
+    async def connect(self):
+        client = self.client
+        asyncssh = drivers.load('asyncssh')
+        self.connection = await asyncssh.connect(client.host, port=client.port, username=client.user, password=client.password, known_hosts=None)
+
+    async def run(self, raw_input):
+        result = await self.connection.run(raw_input)
+        return result.stdout
+
+    async def close(self):
+        self.connection.close()
+        await self.connection.wait_closed()
+
+
+def create_client(cmd_type, host, port, user, password, name='', native=True):
+    client = main.create_client(cmd_type, host, port, user, password, name)
+    if client is None:
+        return None
+    if native and isinstance(client, main.Mysql) and drivers.optional('aiomysql'):
+        return AsyncMysql(client)
+    if native and isinstance(client, main.Linux) and drivers.optional('asyncssh'):
+        return AsyncLinux(client)
+    return ExecutorClient(client)
+
+
+async def run_target(target, command, native=True):
+    client = create_client(target['type'], target['host'], target['port'], target['user'], target['password'], target.get('name', ''), native)
+    if client is None:
+        raise ValueError(f"invalid type: {target['type']}")
+    async with client:
+        return await client.run(target.get('command') or command)
+
+
+async def run_batch(targets, command, concurrency=100, timeout=60, native=True):
+    # async counterpart of batch.run_batch: yields (target, result, error)
+    # in completion order with at most 'concurrency' operations in flight
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(target):
+        async with semaphore:
+            try:
+                return target, await asyncio.wait_for(run_target(target, command, native), timeout), None
+            except asyncio.TimeoutError:
+                return target, None, f'timed out after {timeout}s'
+            except Exception as e:
+                return target, None, str(e)
+
+    for task in asyncio.as_completed([one(target) for target in targets]):
+        yield await task
@@ -0,0 +1,84 @@
+import csv
+import json
+import queue
+import threading
+import time
+from collections import deque
+
+import topology
+import watermark
+from main import create_client
+
+
+def load_inventory(path):
+    # either a JSON list of targets or a CSV file with a header row of
+    # type,host,port,user,password[,name[,command]]
+    with open(path, newline='') as f:
+        if path.endswith('.json'):
+            targets = json.load(f)
+        else:
+            targets = [row for row in csv.DictReader(f) if row.get('host')]
+    for target in targets:
+        target['port'] = int(target['port'])
+    return targets
+
+
+def describe(target):
+    return {key: target.get(key) for key in ('job', 'type', 'host', 'port', 'name') if target.get(key)}
+
+
+def run_target(target, command):
+    client = create_client(target['type'], target['host'], target['port'], target['user'], target['password'], target.get('name', ''),
+                           topology.parse_replicas(target.get('replicas')), str(target.get('read_only', '')).lower() in ('1', 'true', 'yes'))
+    if client is None:
+        raise ValueError(f"invalid type: {target['type']}")
+    params = target.get('params')
+    if target.get('watermark'):
+        return watermark.poll(client, target.get('command') or command, target['watermark'], params)
+    with client.borrow() as conn:
+        if params is None:
+            return conn.run(target.get('command') or command)
+        return conn.run(target.get('command') or command, params)
+
+
+def run_batch(targets, command, concurrency=10, timeout=60):
+    # yields one record per target as soon as that target finishes; a target
+    # that runs past its timeout is reported and its slot handed to the next
+    # one, the stuck thread is left to finish on its own
+    finished = queue.Queue()
+    pending = deque(enumerate(targets))
+    running = {}
+
+    def work(index, target):
+        started = time.monotonic()
+        try:
+            finished.put((index, run_target(target, command), None, time.monotonic() - started))
+        except Exception as e:
+            finished.put((index, None, str(e), time.monotonic() - started))
+
+    while pending or running:
+        while pending and len(running) < concurrency:
+            index, target = pending.popleft()
+            running[index] = (target, time.monotonic())
+            threading.Thread(target=work, args=(index, target), daemon=True).start()
+
+        deadline = min(started for _, started in running.values()) + timeout
+        try:
+            index, result, error, elapsed = finished.get(timeout=max(0, deadline - time.monotonic()))
+        except queue.Empty:
+            now = time.monotonic()
+            for index, (target, started) in list(running.items()):
+                if now - started >= timeout:
+                    del running[index]
+                    yield dict(describe(target), error=f'timed out after {timeout}s', elapsed=now - started)
+            continue
+
+        if index not in running:
+            continue
+        target, _ = running.pop(index)
+        record = dict(describe(target), elapsed=elapsed)
+        if error is None:
+            record['result'] = result
+        else:
+            record['error'] = error
+        yield record
@@ -0,0 +1,240 @@
+import base64
+import datetime
+import re
+import socket
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import drivers
+
+
+# DB-API stand-in: every query returns `rows` generated rows of `columns`
+# mixed-type values after `latency` seconds; ping queries return one row
+
+class FakeCursor:
+    def __init__(self, driver):
+        self.driver = driver
+        self.description = None
+        self.rowcount = -1
+        self.arraysize = 1
+        self.rows = iter(())
+
+    def execute(self, query, params=None):
+        time.sleep(self.driver.latency)
+        if query.strip().upper().startswith(('SELECT 1', 'DECLARE')):
+            self.description = [('1', None, None, None, None, None, None)]
+            self.rows = iter([(1,)])
+            self.rowcount = 1
+            return
+        self.description = [(f'col{index}', None, None, None, None, None, None) for index in range(self.driver.columns)]
+        self.rows = (self.driver.row(index) for index in range(self.driver.rows))
+        self.rowcount = self.driver.rows
+
+    def executemany(self, query, rows):
+        time.sleep(self.driver.latency)
+        self.rowcount = len(rows)
+
+    def fetchone(self):
+        return next(self.rows, None)
+
+    def fetchmany(self, size=None):
+        return [row for _, row in zip(range(size or self.arraysize), self.rows)]
+
+    def fetchall(self):
+        return list(self.rows)
+
+    def close(self):
+        self.rows = iter(())
+
+
+class FakeConnection:
+    def __init__(self, driver):
+        self.driver = driver
+        self.stmtcachesize = 20
+
+    def cursor(self, *args, **kwargs):
+        return FakeCursor(self.driver)
+
+    def ping(self, reconnect=False):
+        time.sleep(self.driver.latency)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeDriver:
+    def __init__(self, rows=1000, columns=6, latency=0.0005, connect_latency=0.005):
+        self.rows = rows
+        self.columns = columns
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.connects = 0
+        # module attributes the clients in main.py reach for
+        self.cursors = SimpleNamespace(SSCursor=FakeCursor)
+        self._mssql = SimpleNamespace(substitute_params=lambda query, params: query)
+
+    def row(self, index):
+        values = (index, f'name-{index}', index * 1.5, datetime.date(2020, 1, 1) + datetime.timedelta(days=index % 3650))
+        return tuple(values[column % len(values)] for column in range(self.columns))
+
+    def connect(self, *args, **kwargs):
+        time.sleep(self.connect_latency)
+        self.connects += 1
+        return FakeConnection(self)
+
+    def makedsn(self, host, port, name):
+        return f'{host}:{port}/{name}'
+
+
+def install_database_drivers(**options):
+    driver = FakeDriver(**options)
+    for name in ('pymysql', 'cx_Oracle', 'pymssql'):
+        drivers.register(name, driver)
+    drivers.register('pymysql.cursors', driver.cursors)
+    drivers.register('pymssql._mssql', driver._mssql)
+    return driver
+
+
+# in-process SSH server (paramiko server mode): every exec request writes
+# `output_bytes` bytes of stdout after `latency` seconds and exits 0
+
+class SSHServer:
+    def __init__(self, output_bytes=4096, latency=0.001):
+        paramiko = drivers.load('paramiko')
+        self.paramiko = paramiko
+        self.output_bytes = output_bytes
+        self.latency = latency
+        self.handshakes = 0
+        self.key = paramiko.RSAKey.generate(2048)
+        self.socket = socket.socket()
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.listen(128)
+        self.port = self.socket.getsockname()[1]
+        self.transports = []
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        server = self.interface()
+        while True:
+            try:
+                connection, _ = self.socket.accept()
+            except OSError:
+                return
+            self.handshakes += 1
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            transport = self.paramiko.Transport(connection)
+            transport.add_server_key(self.key)
+            transport.start_server(server=server)
+            self.transports.append(transport)
+
+    def interface(self):
+        paramiko = self.paramiko
+        fake = self
+
+        class Interface(paramiko.ServerInterface):
+            def get_allowed_auths(self, username):
+                return 'password'
+
+            def check_auth_password(self, username, password):
+                return paramiko.AUTH_SUCCESSFUL
+
+            def check_channel_request(self, kind, chanid):
+                return paramiko.OPEN_SUCCEEDED
+
+            def check_channel_exec_request(self, channel, command):
+                threading.Thread(target=fake.respond, args=(channel,), daemon=True).start()
+                return True
+
+        return Interface()
+
+    def respond(self, channel):
+        time.sleep(self.latency)
+        channel.sendall(b'x' * self.output_bytes)
+        channel.send_exit_status(0)
+        # EOF rather than close: a close can overtake the exec reply and the
+        # client would see the channel die before its command started
+        channel.shutdown_write()
+
+    def close(self):
+        self.socket.close()
+        for transport in self.transports:
+            transport.close()
+
+
+# WS-Management endpoint speaking just enough of the shell protocol for
+# pywinrm: Create, Command, Receive, Signal and Delete
+
+ENVELOPE = ('<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope" '
+            'xmlns:a="http://schemas.xmlsoap.org/ws/2004/08/addressing" '
+            'xmlns:w="http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd" '
+            'xmlns:x="http://schemas.xmlsoap.org/ws/2004/09/transfer" '
+            'xmlns:rsp="http://schemas.microsoft.com/wbem/wsman/1/windows/shell">'
+            '<s:Header><a:RelatesTo>{message_id}</a:RelatesTo></s:Header><s:Body>{body}</s:Body></s:Envelope>')
+
+
+class WinRMServer:
+    def __init__(self, output_bytes=4096, latency=0.001):
+        self.output_bytes = output_bytes
+        self.latency = latency
+        self.shells = 0
+        self.commands = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler())
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def respond(self, request):
+        action = re.search(r'Action[^>]*>([^<]+)<', request).group(1).rsplit('/', 1)[-1]
+        message_id = re.search(r'MessageID[^>]*>([^<]+)<', request).group(1)
+        if action == 'Create':
+            self.shells += 1
+            body = (f'<x:ResourceCreated><a:ReferenceParameters><w:SelectorSet>'
+                    f'<w:Selector Name="ShellId">{uuid.uuid4()}</w:Selector>'
+                    f'</w:SelectorSet></a:ReferenceParameters></x:ResourceCreated>')
+        elif action == 'Command':
+            self.commands += 1
+            body = f'<rsp:CommandResponse><rsp:CommandId>{uuid.uuid4()}</rsp:CommandId></rsp:CommandResponse>'
+        elif action == 'Receive':
+            time.sleep(self.latency)
+            output = base64.b64encode(b'x' * self.output_bytes).decode()
+            body = (f'<rsp:ReceiveResponse><rsp:Stream Name="stdout">{output}</rsp:Stream>'
+                    f'<rsp:CommandState State="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/CommandState/Done">'
+                    f'<rsp:ExitCode>0</rsp:ExitCode></rsp:CommandState></rsp:ReceiveResponse>')
+        else:
+            body = ''
+        return ENVELOPE.format(message_id=message_id, body=body).encode()
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                request = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+                response = fake.respond(request)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/soap+xml;charset=UTF-8')
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,45 @@
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from drivers import BACKENDS
+
+
+def import_seconds(statement, repeat):
+    # best of several fresh interpreters, so nothing is already in sys.modules
+    code = f"import time; t = time.perf_counter(); {statement}; print(time.perf_counter() - t)"
+    best = None
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True)
+        if result.returncode != 0:
+            return None
+        seconds = float(result.stdout.strip())
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Driver import cost per backend')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Interpreters started per measurement')
+    args = parser.parse_args()
+
+    base = import_seconds('import main', args.repeat)
+    print(f"{'import main':<24}{base * 1000:>10.1f} ms")
+
+    costs = {}
+    for type_str, module in BACKENDS.items():
+        costs[type_str] = import_seconds(f'import {module}', args.repeat)
+        cost = 'not installed' if costs[type_str] is None else f'{costs[type_str] * 1000:.1f} ms'
+        print(f"{type_str + ' (' + module + ')':<24}{cost:>10}")
+
+    # what a process that only ever talks to one backend no longer pays; shared
+    # dependencies (cryptography) are counted per driver, so it is an upper bound
+    installed = {type_str: cost for type_str, cost in costs.items() if cost is not None}
+    print()
+    for type_str in installed:
+        saved = sum(cost for other, cost in installed.items() if other != type_str)
+        print(f"{type_str + ' only, saved':<24}{saved * 1000:>10.1f} ms")
@@ -0,0 +1,172 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import fakes
+import main
+import pool
+import sessions
+
+
+BASELINE = os.path.join(HERE, 'baseline.json')
+HIGHER_IS_BETTER = {'ops_per_s'}
+
+
+def timed(func):
+    started = time.perf_counter()
+    func()
+    return (time.perf_counter() - started) * 1000
+
+
+def run_once(client, command):
+    with client.borrow() as conn:
+        return conn.run(command)
+
+
+def cold(make, command, reset, repeat):
+    # first command on a fresh connection: handshake, auth and shell setup
+    samples = []
+    for _ in range(repeat):
+        reset()
+        samples.append(timed(lambda: run_once(make(), command)))
+    return statistics.median(samples)
+
+
+def warm(make, command, repeat):
+    client = make()
+    run_once(client, command)
+    return statistics.median(timed(lambda: run_once(client, command)) for _ in range(repeat))
+
+
+def throughput(make, command, threads, per_thread):
+    run_once(make(), command)
+
+    def work():
+        client = make()
+        for _ in range(per_thread):
+            run_once(client, command)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return threads * per_thread / (time.perf_counter() - started)
+
+
+def memory(make, command, rows):
+    # peak Python allocations while fetching everything vs streaming
+    client = make()
+    with client.borrow() as conn:
+        tracemalloc.start()
+        conn.run(command)
+        _, fetchall_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        tracemalloc.start()
+        for _ in conn.stream(command):
+            pass
+        _, stream_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {'bytes_per_row': fetchall_peak / rows, 'stream_peak_bytes': stream_peak}
+
+
+def measure(args):
+    results = {}
+    fakes.install_database_drivers(rows=args.rows, latency=args.latency, connect_latency=args.connect_latency)
+    ssh_server = fakes.SSHServer(output_bytes=args.output_bytes, latency=args.latency)
+    winrm_server = fakes.WinRMServer(output_bytes=args.output_bytes, latency=args.latency)
+    targets = {
+        'Mysql': (0, 'SELECT * FROM bench', pool.close_all),
+        'Oracle': (0, 'SELECT * FROM bench', pool.close_all),
+        'Sqlserver': (0, 'SELECT * FROM bench', pool.close_all),
+        'Linux': (ssh_server.port, 'bench', sessions.ssh.close_all),
+        'Windows': (winrm_server.port, 'bench', sessions.wsman.close_all),
+    }
+    try:
+        for type_str, (port, command, reset) in targets.items():
+            if args.only and type_str.lower() not in args.only:
+                continue
+
+            def make():
+                return main.create_client(type_str, '127.0.0.1', port, 'bench', 'bench', 'bench')
+
+            result = {
+                'cold_ms': cold(make, command, reset, args.repeat),
+                'warm_ms': warm(make, command, args.repeat),
+                'ops_per_s': throughput(make, command, args.threads, args.per_thread),
+            }
+            if issubclass(type(make()), main.Database):
+                result.update(memory(make, command, args.rows))
+            results[type_str] = result
+            print(type_str, ' '.join(f'{metric}={value:.2f}' for metric, value in result.items()))
+    finally:
+        ssh_server.close()
+        winrm_server.close()
+        pool.close_all()
+        sessions.ssh.close_all()
+        sessions.wsman.close_all()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for type_str, metrics in results.items():
+        for metric, value in metrics.items():
+            previous = baseline.get(type_str, {}).get(metric)
+            if not previous:
+                continue
+            change = (value - previous) / previous
+            if metric in HIGHER_IS_BETTER:
+                change = -change
+            if change > tolerance:
+                regressions.append(f'{type_str} {metric}: {previous:.2f} -> {value:.2f} ({change:+.0%} worse)')
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark every client type against local stand-ins')
+    parser.add_argument('--only', nargs='+', help='Backends to run (mysql, oracle, sqlserver, linux, windows)')
+    parser.add_argument('--rows', type=int, default=10000, help='Rows returned per query')
+    parser.add_argument('--output-bytes', type=int, default=4096, help='Bytes of stdout per remote command')
+    parser.add_argument('--latency', type=float, default=0.001, help='Simulated server time per call, seconds')
+    parser.add_argument('--connect-latency', type=float, default=0.005, help='Simulated database connect time, seconds')
+    parser.add_argument('--repeat', type=int, default=20, help='Samples per latency measurement')
+    parser.add_argument('--threads', type=int, default=8, help='Concurrent clients for throughput')
+    parser.add_argument('--per-thread', type=int, default=25, help='Commands per client for throughput')
+    parser.add_argument('--baseline', type=str, default=BASELINE, help='Baseline JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown before flagging, as a fraction')
+    parser.add_argument('--save', action='store_true', help='Store these results as the new baseline')
+    parser.add_argument('--check', action='store_true', help='Fail when there is no baseline to compare against')
+    args = parser.parse_args()
+    if args.only:
+        args.only = [name.lower() for name in args.only]
+
+    results = measure(args)
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Baseline saved: {args.baseline}')
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            exit(1)
+        print('No regressions against baseline')
+    else:
+        # timings depend on the machine, so the baseline is made where the
+        # comparison runs: check out a known-good commit and run with --save
+        print(f'No baseline at {args.baseline}, nothing compared; run with --save on a known-good commit to create one')
+        if args.check:
+            exit(2)
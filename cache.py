@@ -0,0 +1,123 @@
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+from pool import fingerprint
+
+
+READ_ONLY = re.compile(r'^\s*(select|with|show|describe|desc|explain)\b', re.IGNORECASE)
+WRITES = re.compile(r'\b(insert|update|delete|merge|replace|create|alter|drop|truncate|rename|grant|revoke|into|call|exec|execute|begin|commit|rollback|lock|set|for\s+update|nextval)\b', re.IGNORECASE)
+
+# OS commands that only read state; anything else is never cached
+ALLOWED_COMMANDS = {
+    'hostname', 'whoami', 'uptime', 'uname -a', 'df -h', 'free -m', 'ifconfig', 'ip addr',
+    'ipconfig', 'ipconfig /all', 'systeminfo', 'ver',
+}
+
+
+def normalize(command):
+    return ' '.join(str(command).split()).rstrip(';').strip()
+
+
+def cacheable(client, command):
+    command = normalize(command)
+    if client.type in ('Linux', 'Windows'):
+        return command in ALLOWED_COMMANDS
+    return bool(READ_ONLY.match(command)) and not WRITES.search(command) and ';' not in command
+
+
+def sizeof(value, depth=3):
+    size = sys.getsizeof(value)
+    if depth and isinstance(value, (list, tuple)):
+        size += sum(sizeof(item, depth - 1) for item in value)
+    return size
+
+
+class ResultCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=30):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> (expires, size, value), least recently used first
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def key(self, client, command, params=None):
+        return client.key() + (fingerprint(client.password), normalize(command), repr(params))
+
+    def get(self, client, command, params=None):
+        key = self.key(client, command, params)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    self.remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, client, command, value, ttl=None, params=None):
+        key = self.key(client, command, params)
+        size = sizeof(value)
+        if size > self.max_bytes:
+            return
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (expires, size, value)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def remove(self, key):
+        # caller holds the lock
+        _, size, _ = self.entries.pop(key)
+        self.bytes -= size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+    def run(self, client, command, ttl=None, refresh=False, params=None):
+        if not refresh and cacheable(client, command):
+            result = self.get(client, command, params)
+            if result is not None:
+                return result
+        with client.borrow() as conn:
+            result = conn.run(command) if params is None else conn.run(command, params)
+        if cacheable(client, command):
+            self.put(client, command, result, ttl, params)
+        return result
+
+    def metrics_lines(self):
+        stats = self.stats()
+        return ['# TYPE result_cache_hits_total counter', f"result_cache_hits_total {stats['hits']}",
+                '# TYPE result_cache_misses_total counter', f"result_cache_misses_total {stats['misses']}",
+                '# TYPE result_cache_bytes gauge', f"result_cache_bytes {stats['bytes']}"]
+
+
+results = ResultCache()
+
+metrics.registry.collectors.append(results.metrics_lines)
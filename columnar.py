@@ -0,0 +1,280 @@
+import csv
+import datetime
+import io
+import json
+import struct
+import sys
+from array import array
+
+import drivers
+
+
+EPOCH = datetime.datetime(1970, 1, 1)
+MICROSECOND = datetime.timedelta(microseconds=1)
+MAGIC = b'DBCOL1\n'
+INTERN_LIMIT = 64
+
+# kind -> array typecode for the column buffer; other kinds are plain lists
+TYPECODES = {'int': 'q', 'bool': 'b', 'float': 'd', 'date': 'i', 'datetime': 'q'}
+# numeric kinds, narrowest first; a mix is stored as the widest seen
+NUMERIC = ('bool', 'int', 'float')
+
+
+def kind_of(value):
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int'
+    if isinstance(value, float):
+        return 'float'
+    if isinstance(value, datetime.datetime):
+        return 'datetime' if value.tzinfo is None else 'object'
+    if isinstance(value, datetime.date):
+        return 'date'
+    if isinstance(value, str):
+        return 'str'
+    return 'object'
+
+
+def encode(kind, value):
+    if kind == 'date':
+        return value.toordinal()
+    if kind == 'datetime':
+        return (value - EPOCH) // MICROSECOND
+    return value
+
+
+def decode(kind, value):
+    if kind == 'date':
+        return datetime.date.fromordinal(value)
+    if kind == 'datetime':
+        return EPOCH + value * MICROSECOND
+    if kind == 'bool':
+        return bool(value)
+    return value
+
+
+class Column:
+    def __init__(self, name):
+        self.name = name
+        self.kind = None
+        self.values = []
+        # one byte per row, 1 where the value is NULL
+        self.nulls = bytearray()
+
+    def __len__(self):
+        return len(self.nulls)
+
+    def append(self, value):
+        if value is None:
+            self.nulls.append(1)
+            self.values.append(0 if self.kind in TYPECODES else None)
+            return
+        kind = kind_of(value)
+        if self.kind is None:
+            self.start(kind)
+        elif kind != self.kind and self.kind != 'object':
+            if kind in NUMERIC and self.kind in NUMERIC:
+                # cx_Oracle returns int or float value by value for one NUMBER column
+                self.widen(max(kind, self.kind, key=NUMERIC.index))
+            else:
+                self.promote()
+        if self.kind == 'str' and len(value) <= INTERN_LIMIT:
+            value = sys.intern(value)
+        try:
+            self.values.append(encode(self.kind, value))
+        except OverflowError:
+            self.promote()
+            self.values.append(value)
+        self.nulls.append(0)
+
+    def start(self, kind):
+        # rows seen so far were all NULL
+        self.kind = kind
+        if kind in TYPECODES:
+            self.values = array(TYPECODES[kind], [0] * len(self.nulls))
+        else:
+            self.values = [None] * len(self.nulls)
+
+    def widen(self, kind):
+        if kind != self.kind:
+            self.values = array(TYPECODES[kind], self.values)
+            self.kind = kind
+
+    def promote(self):
+        # mixed or out-of-range values: fall back to a list of Python objects
+        self.values = [None if null else decode(self.kind, value) for value, null in zip(self.values, self.nulls)]
+        self.kind = 'object'
+
+    def get(self, index):
+        if self.nulls[index]:
+            return None
+        return decode(self.kind, self.values[index])
+
+    def buffer(self, start, stop):
+        # zero-copy view of a numeric column
+        return memoryview(self.values)[start:stop]
+
+
+class ColumnarResult:
+    def __init__(self, columns, start=0, stop=None):
+        self.columns = columns
+        self.start = start
+        self.stop = len(columns[0]) if stop is None and columns else (stop or 0)
+
+    @classmethod
+    def from_batches(cls, column_names, batches):
+        columns = [Column(name) for name in column_names]
+        for rows in batches:
+            for row in rows:
+                for column, value in zip(columns, row):
+                    column.append(value)
+        return cls(columns)
+
+    @property
+    def column_names(self):
+        return [column.name for column in self.columns]
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError("columnar slices do not support a step")
+            return ColumnarResult(self.columns, self.start + start, self.start + max(start, stop))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return tuple(column.get(self.start + index) for column in self.columns)
+
+    def page(self, number, size):
+        return self[number * size:(number + 1) * size]
+
+    def rows(self):
+        for index in range(self.start, self.stop):
+            yield tuple(column.get(index) for column in self.columns)
+
+    def column(self, name):
+        column = self.columns[self.column_names.index(name)]
+        if column.kind in TYPECODES and column.kind not in ('date', 'datetime') and not any(column.nulls[self.start:self.stop]):
+            return column.buffer(self.start, self.stop)
+        return [column.get(index) for index in range(self.start, self.stop)]
+
+    def to_numpy(self, name):
+        numpy = drivers.load('numpy')
+        column = self.columns[self.column_names.index(name)]
+        if column.kind not in TYPECODES:
+            return numpy.array(self.column(name), dtype=object)
+        values = numpy.frombuffer(column.buffer(self.start, self.stop), dtype=column.values.typecode)
+        if column.kind == 'date':
+            values = (values - datetime.date(1970, 1, 1).toordinal()).astype('datetime64[D]')
+        elif column.kind == 'datetime':
+            values = values.astype('datetime64[us]')
+        nulls = numpy.frombuffer(column.nulls, dtype=numpy.uint8)[self.start:self.stop].astype(bool)
+        return numpy.ma.masked_array(values, mask=nulls) if nulls.any() else values
+
+    def iter_json(self, chunk_rows=1000):
+        yield json.dumps({'columns': self.column_names})[:-1] + ', "rows": ['
+        for start in range(0, len(self), chunk_rows):
+            chunk = self[start:start + chunk_rows]
+            text = ', '.join(json.dumps(row, default=str) for row in chunk.rows())
+            yield text if start == 0 else ', ' + text
+        yield ']}'
+
+    def iter_csv(self, chunk_rows=1000):
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(self.column_names)
+        for start in range(0, len(self), chunk_rows):
+            writer.writerows(self[start:start + chunk_rows].rows())
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+        if out.tell():
+            yield out.getvalue()
+
+    def iter_binary(self):
+        # MAGIC, a length-prefixed JSON header, then per column the NULL mask
+        # and either the raw array buffer or utf-8 offsets + data
+        header = json.dumps({'columns': [{'name': column.name, 'kind': column.kind or 'object'} for column in self.columns],
+                             'length': len(self)}).encode()
+        yield MAGIC + struct.pack('<I', len(header)) + header
+        for column in self.columns:
+            yield bytes(column.nulls[self.start:self.stop])
+            if column.kind in TYPECODES:
+                data = column.buffer(self.start, self.stop).tobytes()
+                yield struct.pack('<Q', len(data)) + data
+                continue
+            offsets = array('q', [0])
+            chunks = []
+            for index in range(self.start, self.stop):
+                value = column.get(index)
+                if value is not None:
+                    encoded = (value if isinstance(value, str) else str(value)).encode()
+                    chunks.append(encoded)
+                    offsets.append(offsets[-1] + len(encoded))
+                else:
+                    offsets.append(offsets[-1])
+            yield struct.pack('<Q', len(offsets) * 8) + offsets.tobytes()
+            yield struct.pack('<Q', offsets[-1]) + b''.join(chunks)
+
+    def to_json(self):
+        return ''.join(self.iter_json())
+
+    def to_csv(self):
+        return ''.join(self.iter_csv())
+
+    def to_binary(self):
+        return b''.join(self.iter_binary())
+
+
+def read_frame(data, position=0):
+    if data[position:position + len(MAGIC)] != MAGIC:
+        raise ValueError("not a columnar result")
+    position += len(MAGIC)
+    (size,) = struct.unpack_from('<I', data, position)
+    position += 4
+    header = json.loads(data[position:position + size])
+    position += size
+    length = header['length']
+    columns = []
+    for spec in header['columns']:
+        column = Column(spec['name'])
+        column.kind = spec['kind']
+        column.nulls = bytearray(data[position:position + length])
+        position += length
+        (size,) = struct.unpack_from('<Q', data, position)
+        position += 8
+        if column.kind in TYPECODES:
+            column.values = array(TYPECODES[column.kind])
+            column.values.frombytes(data[position:position + size])
+            position += size
+        else:
+            offsets = array('q')
+            offsets.frombytes(data[position:position + size])
+            position += size
+            (size,) = struct.unpack_from('<Q', data, position)
+            position += 8
+            text = data[position:position + size]
+            position += size
+            column.values = [None if column.nulls[index] else text[offsets[index]:offsets[index + 1]].decode()
+                             for index in range(length)]
+            if column.kind != 'str':
+                column.kind = 'object'
+        columns.append(column)
+    return ColumnarResult(columns, 0, length), position
+
+
+def read_binary(data):
+    return read_frame(data)[0]
+
+
+def read_frames(data):
+    # a stream of frames, as written one per batch by export
+    position = 0
+    while position < len(data):
+        result, position = read_frame(data, position)
+        yield result
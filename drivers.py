@@ -0,0 +1,47 @@
+import importlib
+import threading
+
+
+# the driver module each client type needs, loaded on its first connect()
+BACKENDS = {
+    'Mysql': 'pymysql',
+    'Oracle': 'cx_Oracle',
+    'Sqlserver': 'pymssql',
+    'Windows': 'winrm',
+    'Linux': 'paramiko',
+}
+
+_modules = {}
+_lock = threading.Lock()
+
+
+def load(name):
+    module = _modules.get(name)
+    if module is None:
+        with _lock:
+            module = _modules.get(name)
+            if module is None:
+                try:
+                    module = importlib.import_module(name)
+                except ImportError as e:
+                    raise ImportError(f"driver '{name}' is not installed: {e}") from e
+                _modules[name] = module
+    return module
+
+
+def optional(name):
+    try:
+        return load(name)
+    except ImportError:
+        return None
+
+
+def register(name, module):
+    # lets tests and benchmarks swap a driver for a stand-in
+    with _lock:
+        _modules[name] = module
+
+
+def loaded():
+    with _lock:
+        return sorted(_modules)
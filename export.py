@@ -0,0 +1,127 @@
+import csv
+import io
+import json
+import zlib
+
+import columnar
+import drivers
+
+
+FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'columnar': 'application/octet-stream',
+}
+# preference order when the client accepts several
+ENCODINGS = ('zstd', 'gzip')
+
+
+def encode_json(columns, batches):
+    yield (json.dumps({'columns': columns})[:-1] + ', "rows": [').encode()
+    separator = ''
+    for rows in batches:
+        for row in rows:
+            yield (separator + json.dumps(row, default=str)).encode()
+            separator = ', '
+    yield b']}'
+
+
+def encode_ndjson(columns, batches):
+    for rows in batches:
+        yield ''.join(json.dumps(dict(zip(columns, row)), default=str) + '\n' for row in rows).encode()
+
+
+def encode_csv(columns, batches):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(columns)
+    for rows in batches:
+        writer.writerows(rows)
+        yield out.getvalue().encode()
+        out.seek(0)
+        out.truncate()
+    if out.tell():
+        yield out.getvalue().encode()
+
+
+def encode_columnar(columns, batches):
+    # one columnar.read_frames frame per fetched batch
+    empty = True
+    for rows in batches:
+        empty = False
+        yield columnar.ColumnarResult.from_batches(columns, [rows]).to_binary()
+    if empty:
+        yield columnar.ColumnarResult.from_batches(columns, []).to_binary()
+
+
+def encode_arrow(columns, batches, pyarrow):
+    # Arrow IPC stream; the schema is taken from the first batch
+    out = io.BytesIO()
+    writer = schema = None
+    for rows in batches:
+        values = list(zip(*rows))
+        if writer is None:
+            arrays = [pyarrow.array(value) for value in values]
+            schema = pyarrow.schema([(name, array.type) for name, array in zip(columns, arrays)])
+            writer = pyarrow.ipc.new_stream(out, schema)
+        else:
+            arrays = [pyarrow.array(value, type=field.type) for value, field in zip(values, schema)]
+        writer.write_batch(pyarrow.RecordBatch.from_arrays(arrays, names=columns))
+        yield out.getvalue()
+        out.seek(0)
+        out.truncate()
+    if writer is None:
+        writer = pyarrow.ipc.new_stream(out, pyarrow.schema([(name, pyarrow.null()) for name in columns]))
+    writer.close()
+    yield out.getvalue()
+
+
+ENCODERS = {'json': encode_json, 'ndjson': encode_ndjson, 'csv': encode_csv, 'columnar': encode_columnar}
+
+
+def negotiate(accept_encoding):
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        name, _, quality = item.strip().partition(';')
+        try:
+            accepted[name.strip().lower()] = float(quality.strip()[2:]) if quality.strip().startswith('q=') else 1.0
+        except ValueError:
+            continue
+    for encoding in ENCODINGS:
+        if accepted.get(encoding, accepted.get('*', 0)) > 0 and (encoding != 'zstd' or drivers.optional('zstandard')):
+            return encoding
+    return None
+
+
+def compress(chunks, encoding):
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    elif encoding == 'zstd':
+        compressor = drivers.load('zstandard').ZstdCompressor().compressobj()
+    else:
+        yield from chunks
+        return
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export(output, columns, batches, encoding=None):
+    # checked here rather than inside the generators so a bad format fails
+    # before a response has started
+    if output not in FORMATS:
+        raise ValueError(f"unknown format '{output}', expected one of: {', '.join(FORMATS)}")
+    if encoding not in (None, 'identity') + ENCODINGS:
+        raise ValueError(f"unknown encoding '{encoding}'")
+    if output == 'arrow':
+        pyarrow = drivers.optional('pyarrow')
+        if pyarrow is None:
+            raise ValueError("format 'arrow' needs pyarrow; use 'columnar' instead")
+        chunks = encode_arrow(columns, batches, pyarrow)
+    else:
+        chunks = ENCODERS[output](columns, batches)
+    return compress(chunks, encoding)
@@ -0,0 +1,274 @@
+import argparse
+import queue
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import export
+import metrics
+import pool
+from main import Database, Oracle, create_client
+
+
+IDENTIFIER = re.compile(r'^[A-Za-z_][\w$#]*(\.[A-Za-z_][\w$#]*)?$')
+
+# one ROWID range per extent of the table (or of each of its partitions)
+ROWID_RANGES = """
+SELECT DBMS_ROWID.ROWID_CREATE(1, o.data_object_id, e.relative_fno, e.block_id, 0),
+       DBMS_ROWID.ROWID_CREATE(1, o.data_object_id, e.relative_fno, e.block_id + e.blocks - 1, 32767),
+       e.blocks
+FROM {view}_extents e
+JOIN {view}_objects o ON o.object_name = e.segment_name
+ AND NVL(o.subobject_name, '-') = NVL(e.partition_name, '-') AND o.data_object_id IS NOT NULL{owner_join}
+WHERE e.segment_name = :1{owner_filter}
+ORDER BY e.relative_fno, e.block_id
+"""
+
+KEEP_FINISHED = 50
+
+extractions = OrderedDict()
+_lock = threading.Lock()
+
+
+def identifier(name):
+    if not IDENTIFIER.match(str(name)):
+        raise ValueError(f"invalid identifier: {name}")
+    return name
+
+
+class Extraction:
+    def __init__(self, client, table, key=None, columns=None, partitions=None, parallel=4, ordered=False, rowid=False,
+                 batch_size=None):
+        if not isinstance(client, Database):
+            raise ValueError("extraction needs a database type")
+        if rowid and not isinstance(client, Oracle):
+            raise ValueError("ROWID ranges are only available on Oracle")
+        if not rowid and not key:
+            raise ValueError("a key column is needed to split the table")
+        self.id = uuid.uuid4().hex
+        self.client = client
+        self.table = identifier(table)
+        self.key = identifier(key) if key else None
+        self.columns = [identifier(column) for column in columns] if columns else ['*']
+        self.parallel = parallel
+        self.partition_count = partitions or parallel * 4
+        self.ordered = ordered
+        self.rowid = rowid
+        self.batch_size = batch_size
+        self.stop = threading.Event()
+        self.progress = []
+        self.started = time.time()
+        self.finished = None
+        self.error = None
+        with _lock:
+            extractions[self.id] = self
+            finished = [key for key, extraction in extractions.items() if extraction.finished]
+            for key in finished[:-KEEP_FINISHED]:
+                del extractions[key]
+
+    def borrow(self):
+        return self.client.borrow(max_size=max(self.parallel, pool.DEFAULTS['max_size']))
+
+    def select(self):
+        return f"SELECT {', '.join(self.columns)} FROM {self.table}"
+
+    def describe(self):
+        with self.borrow() as conn:
+            for _ in conn.stream(self.select() + ' WHERE 1 = 0'):
+                pass
+            return [desc[0] for desc in conn.description]
+
+    def plan(self):
+        # a partition is a list of (where clause, params) pieces read in turn
+        with self.borrow() as conn:
+            if self.rowid:
+                return self.rowid_partitions(conn)
+            return self.key_partitions(conn)
+
+    def key_partitions(self, conn):
+        key, bind = self.key, conn.placeholder
+        conn.cursor.execute(f'SELECT MIN({key}), MAX({key}) FROM {self.table}')
+        low, high = conn.cursor.fetchone()
+        if low is None:
+            return []
+        if isinstance(low, int) and isinstance(high, int):
+            step = max(1, -(-(high - low + 1) // self.partition_count))
+            starts = list(range(low, high + 1, step))
+        else:
+            # evenly filled ranges for keys that cannot be split arithmetically
+            conn.cursor.execute(f'SELECT MIN({key}) FROM (SELECT {key}, NTILE({int(self.partition_count)}) OVER '
+                                f'(ORDER BY {key}) tile FROM {self.table}) t GROUP BY tile ORDER BY 1')
+            starts = [row[0] for row in conn.cursor.fetchall()]
+        partitions = []
+        for index, start in enumerate(starts):
+            # open-ended first and last ranges also catch rows added meanwhile
+            if len(starts) == 1:
+                partitions.append([('1 = 1', ())])
+            elif index == 0:
+                partitions.append([(f'{key} < {bind(0)}', (starts[1],))])
+            elif index == len(starts) - 1:
+                partitions.append([(f'{key} >= {bind(0)}', (start,))])
+            else:
+                partitions.append([(f'{key} >= {bind(0)} AND {key} < {bind(1)}', (start, starts[index + 1]))])
+        return partitions
+
+    def rowid_partitions(self, conn):
+        owner, _, table = self.table.rpartition('.')
+        if owner:
+            query = ROWID_RANGES.format(view='dba', owner_join=' AND o.owner = e.owner', owner_filter=' AND e.owner = :2')
+            conn.cursor.execute(query, (table.upper(), owner.upper()))
+        else:
+            query = ROWID_RANGES.format(view='user', owner_join='', owner_filter='')
+            conn.cursor.execute(query, (table.upper(),))
+        extents = conn.cursor.fetchall()
+        if not extents:
+            return []
+        # consecutive extents grouped into partitions of about equal block count
+        share = sum(extent[2] for extent in extents) / self.partition_count
+        partitions = [[]]
+        filled = 0
+        for start, end, blocks in extents:
+            if filled >= share and len(partitions) < self.partition_count:
+                partitions.append([])
+                filled = 0
+            partitions[-1].append(('ROWID BETWEEN :1 AND :2', (start, end)))
+            filled += blocks
+        return partitions
+
+    def batches(self):
+        # row batches from all partitions, read `parallel` at a time; ordered
+        # output drains partition queues in key order, unordered takes
+        # batches from whichever partition has one
+        partitions = self.plan()
+        self.progress = [{'partition': index, 'rows': 0, 'seconds': 0, 'status': 'pending'} for index in range(len(partitions))]
+        # ordered output also sorts inside each partition; ROWID ranges have no key to sort on
+        order = f' ORDER BY {self.key}' if self.ordered and self.key else ''
+        shared = queue.Queue(maxsize=self.parallel * 4)
+        queues = [queue.Queue(maxsize=4) for _ in partitions] if self.ordered else None
+
+        def deliver(target, item):
+            while not self.stop.is_set():
+                try:
+                    target.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def work(index, pieces):
+            target = queues[index] if self.ordered else shared
+            progress = self.progress[index]
+            if self.stop.is_set():
+                progress['status'] = 'cancelled'
+                return
+            progress['status'] = 'running'
+            started = time.perf_counter()
+            try:
+                with metrics.timed('partition', self.client.type, self.client.host), self.borrow() as conn:
+                    for where, params in pieces:
+                        batches = conn.stream(f'{self.select()} WHERE {where}{order}', self.batch_size, list(params) or None)
+                        for rows in batches:
+                            progress['rows'] += len(rows)
+                            progress['seconds'] = time.perf_counter() - started
+                            if not deliver(target, ('rows', index, rows)):
+                                batches.close()
+                                progress['status'] = 'cancelled'
+                                return
+                progress['status'] = 'done'
+                deliver(target, ('done', index, None))
+            except Exception as e:
+                progress['status'] = 'failed'
+                deliver(target, ('error', index, str(e)))
+            finally:
+                progress['seconds'] = time.perf_counter() - started
+                progress['rows_per_s'] = progress['rows'] / progress['seconds'] if progress['seconds'] else 0
+
+        executor = ThreadPoolExecutor(max_workers=self.parallel, thread_name_prefix='extract')
+        try:
+            for index, pieces in enumerate(partitions):
+                executor.submit(work, index, pieces)
+            for index in range(len(partitions)):
+                source = queues[index] if self.ordered else shared
+                while True:
+                    kind, partition, payload = source.get()
+                    if kind == 'error':
+                        raise ValueError(f"partition {partition} failed: {payload}")
+                    if kind == 'done':
+                        break
+                    yield payload
+        except Exception as e:
+            self.error = str(e)
+            raise
+        finally:
+            self.stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.finished = time.time()
+
+    def report(self):
+        rows = sum(progress['rows'] for progress in self.progress)
+        elapsed = (self.finished or time.time()) - self.started
+        return {
+            'id': self.id,
+            'table': self.table,
+            'partitions': len(self.progress),
+            'done': sum(progress['status'] == 'done' for progress in self.progress),
+            'rows': rows,
+            'seconds': elapsed,
+            'rows_per_s': rows / elapsed if elapsed else 0,
+            'finished': self.finished is not None,
+            'error': self.error,
+            'progress': [dict(progress) for progress in self.progress],
+        }
+
+    def export(self, output, encoding=None):
+        return export.export(output, self.describe(), self.batches(), encoding)
+
+
+def get(extraction_id):
+    with _lock:
+        return extractions.get(extraction_id)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extract one table over several connections at once')
+    parser.add_argument('-t', '--type', type=str, required=True, help='Mysql/Oracle/Sqlserver')
+    parser.add_argument('-ho', '--host', type=str, required=True, help='Host IP address')
+    parser.add_argument('-po', '--port', type=int, required=True, help='Port number')
+    parser.add_argument('-u', '--user', type=str, help='Username')
+    parser.add_argument('-pa', '--password', type=str, help='Password')
+    parser.add_argument('-n', '--name', type=str, default='', help='Name')
+    parser.add_argument('--table', type=str, required=True, help='Table to extract ([owner.]table)')
+    parser.add_argument('--key', type=str, help='Primary key column to split ranges on')
+    parser.add_argument('--rowid', action='store_true', help='Split on ROWID ranges instead (Oracle)')
+    parser.add_argument('--columns', nargs='+', help='Columns to extract (default all)')
+    parser.add_argument('--parallel', type=int, default=4, help='Partitions read at once')
+    parser.add_argument('--partitions', type=int, help='Number of partitions (default 4 per connection)')
+    parser.add_argument('--ordered', action='store_true', help='Write rows in key order (partition order only with --rowid)')
+    parser.add_argument('--format', type=str, default='csv', choices=list(export.FORMATS), help='Output format')
+    parser.add_argument('--compress', type=str, choices=export.ENCODINGS, help='Compress the output')
+    parser.add_argument('-b', '--batch-size', type=int, help='Rows per fetch')
+    parser.add_argument('-o', '--output', type=str, help='Output file (default stdout)')
+    args = parser.parse_args()
+
+    client = create_client(args.type, args.host, args.port, args.user, args.password, args.name)
+    extraction = Extraction(client, args.table, args.key, args.columns, args.partitions, args.parallel, args.ordered,
+                            args.rowid, args.batch_size)
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    last = time.monotonic()
+    try:
+        for chunk in extraction.export(args.format, args.compress):
+            out.write(chunk)
+            if time.monotonic() - last >= 1:
+                last = time.monotonic()
+                report = extraction.report()
+                print(f"{report['done']}/{report['partitions']} partitions, {report['rows']} rows, "
+                      f"{report['rows_per_s']:.0f} rows/s", file=sys.stderr)
+    finally:
+        if args.output:
+            out.close()
+    for progress in extraction.report()['progress']:
+        print(progress, file=sys.stderr)
@@ -0,0 +1,264 @@
+import argparse
+import decimal
+import heapq
+import json
+import queue
+import threading
+from functools import total_ordering
+
+import batch
+import topology
+from main import Database, create_client
+
+
+AGGREGATES = ('count', 'sum', 'min', 'max', 'avg')
+
+
+def total(current, value):
+    # MySQL DECIMAL next to Oracle/SQL Server floats: summed as float
+    if isinstance(current, decimal.Decimal) and isinstance(value, float) or \
+            isinstance(current, float) and isinstance(value, decimal.Decimal):
+        return float(current) + float(value)
+    return current + value
+
+
+def source_of(target):
+    source = f"{target.get('host')}:{target.get('port')}"
+    return f"{source}/{target['name']}" if target.get('name') else source
+
+
+def invalid(target):
+    if not isinstance(target, dict):
+        return f"not a target: {target!r}"
+    missing = [field for field in ('type', 'host', 'port') if target.get(field) in (None, '')]
+    return f"missing {', '.join(missing)}" if missing else None
+
+
+def column_list(value):
+    # a JSON body may give one column as a plain string, or 'a,-b'
+    if isinstance(value, str):
+        return [name.strip() for name in value.split(',') if name.strip()]
+    return list(value or [])
+
+
+def column_names(description, aliases):
+    # lower-cased so Oracle's upper-case names line up with the others;
+    # unnamed columns (SELECT @@VERSION) are named by position
+    names = []
+    for index, desc in enumerate(description):
+        name = str(desc[0] or '').lower() or f'col{index}'
+        names.append(aliases.get(name, name))
+    return names
+
+
+def query_for(target, query):
+    # one logical query, optionally spelt per backend: {"oracle": ..., "default": ...}
+    if target.get('command'):
+        return target['command']
+    if isinstance(query, dict):
+        return query.get(str(target['type']).lower()) or query.get('default')
+    return query
+
+
+@total_ordering
+class SortKey:
+    # sort spec entries are column names, '-name' for descending; NULLs last
+    def __init__(self, row, spec):
+        self.values = [row.get(name.lstrip('-')) for name in spec]
+        self.spec = spec
+
+    def __eq__(self, other):
+        return self.values == other.values
+
+    def __lt__(self, other):
+        for name, mine, theirs in zip(self.spec, self.values, other.values):
+            if mine == theirs:
+                continue
+            if mine is None or theirs is None:
+                return theirs is None
+            return mine > theirs if name.startswith('-') else mine < theirs
+        return False
+
+
+class Aggregator:
+    def __init__(self, group_by, aggregates):
+        self.group_by = group_by
+        # output name -> (function, column)
+        self.aggregates = aggregates
+        self.groups = {}
+
+    def add(self, row):
+        key = tuple(row.get(name) for name in self.group_by)
+        state = self.groups.get(key)
+        if state is None:
+            state = self.groups[key] = {name: [0, None] for name in self.aggregates}
+        for name, (function, column) in self.aggregates.items():
+            value = None if column == '*' else row.get(column)
+            if column != '*' and value is None:
+                continue
+            entry = state[name]
+            entry[0] += 1
+            if function in ('sum', 'avg'):
+                entry[1] = value if entry[1] is None else total(entry[1], value)
+            elif function == 'min':
+                entry[1] = value if entry[1] is None or value < entry[1] else entry[1]
+            elif function == 'max':
+                entry[1] = value if entry[1] is None or value > entry[1] else entry[1]
+
+    def rows(self):
+        for key, state in self.groups.items():
+            row = dict(zip(self.group_by, key))
+            for name, (function, _) in self.aggregates.items():
+                seen, value = state[name]
+                if function == 'count':
+                    row[name] = seen
+                elif function == 'avg':
+                    row[name] = value / seen if seen else None
+                else:
+                    row[name] = value
+            yield row
+
+
+def parse_aggregates(specs):
+    # 'name=function:column' strings or a {name: [function, column]} mapping
+    if isinstance(specs, dict):
+        items = specs.items()
+    else:
+        items = []
+        for spec in [specs] if isinstance(specs, str) else specs or []:
+            name, _, expression = spec.partition('=')
+            items.append((name, expression.split(':', 1)))
+    aggregates = {}
+    for name, (function, column) in items:
+        if function.lower() not in AGGREGATES:
+            raise ValueError(f"unknown aggregate '{function}', expected one of: {', '.join(AGGREGATES)}")
+        aggregates[name] = (function.lower(), column.lower() if column != '*' else column)
+    return aggregates
+
+
+def run_federated(targets, query, concurrency=10, sort=None, limit=None, group_by=None, aggregates=None,
+                  aliases=None, batch_size=None):
+    # yields ('row', {...}) with a 'source' column as rows arrive from any
+    # target, ('error', {...}) per failed target and finally ('summary', {...});
+    # sort/limit and aggregation are applied batch by batch as rows come in
+    aliases = {name.lower(): alias for name, alias in (aliases or {}).items()}
+    aggregates = parse_aggregates(aggregates)
+    group_by = [name.lower() for name in column_list(group_by)]
+    sort = [name.lower() for name in column_list(sort)]
+    if group_by and not aggregates:
+        aggregates = {'count': ('count', '*')}
+    aggregator = Aggregator(group_by, aggregates) if aggregates else None
+
+    # bounded, so fast sources wait for the consumer instead of piling up rows
+    arrivals = queue.Queue(maxsize=concurrency * 4)
+    # targets a worker could not even connect to are reported up front
+    rejected = [(target, invalid(target)) for target in targets if invalid(target)]
+    pending = [target for target in targets if not invalid(target)]
+    stop = threading.Event()
+    lock = threading.Lock()
+
+    def deliver(item):
+        # gives up once the consumer has stopped, so a worker never blocks
+        # on a queue nobody reads and its connection goes back to the pool
+        while not stop.is_set():
+            try:
+                arrivals.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def work():
+        while not stop.is_set():
+            with lock:
+                if not pending:
+                    return
+                target = pending.pop(0)
+            source = source_of(target)
+            try:
+                client = create_client(target['type'], target['host'], target['port'], target['user'], target['password'],
+                                       target.get('name', ''), topology.parse_replicas(target.get('replicas')),
+                                       str(target.get('read_only', '')).lower() in ('1', 'true', 'yes'))
+                if not isinstance(client, Database):
+                    raise ValueError(f"not a database type: {target['type']}")
+                with client.borrow() as conn:
+                    batches = conn.stream(query_for(target, query), batch_size, target.get('params'))
+                    names = column_names(conn.description, aliases)
+                    for rows in batches:
+                        if not deliver(('rows', source, names, rows)):
+                            batches.close()
+                            return
+                deliver(('done', source, None, None))
+            except Exception as e:
+                deliver(('error', source, None, str(e)))
+
+    workers = [threading.Thread(target=work, daemon=True) for _ in range(min(concurrency, len(pending)) or 1)]
+    for worker in workers:
+        worker.start()
+
+    finished = 0
+    emitted = 0
+    failed = 0
+    kept = []
+    try:
+        for target, reason in rejected:
+            failed += 1
+            yield 'error', {'source': source_of(target) if isinstance(target, dict) else None, 'error': reason}
+        while finished < len(targets) - len(rejected):
+            kind, source, names, payload = arrivals.get()
+            if kind == 'error':
+                finished += 1
+                failed += 1
+                yield 'error', {'source': source, 'error': payload}
+                continue
+            if kind == 'done':
+                finished += 1
+                continue
+            rows = [dict(zip(names, row), source=source) for row in payload]
+            if aggregator is not None:
+                for row in rows:
+                    aggregator.add(row)
+            elif sort:
+                # with a limit only the best `limit` rows are ever held; a
+                # full sort without one has to wait for every row
+                kept.extend(rows)
+                if limit:
+                    kept = heapq.nsmallest(limit, kept, key=lambda row: SortKey(row, sort))
+            else:
+                for row in rows[:limit - emitted] if limit else rows:
+                    yield 'row', row
+                emitted += min(len(rows), limit - emitted) if limit else len(rows)
+                if limit and emitted >= limit:
+                    break
+        results = aggregator.rows() if aggregator is not None else kept
+        if sort:
+            results = sorted(results, key=lambda row: SortKey(row, sort))
+        for row in list(results)[:limit] if limit else results:
+            emitted += 1
+            yield 'row', row
+        yield 'summary', {'targets': len(targets), 'failed': failed, 'rows': emitted}
+    except Exception as e:
+        # a merge failure (values that cannot be summed or compared) ends
+        # the stream with an error frame instead of cutting it off
+        yield 'error', {'source': None, 'error': f'merge failed: {e}'}
+    finally:
+        stop.set()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run one query on many databases and merge the rows')
+    parser.add_argument('-i', '--inventory', type=str, required=True, help='JSON/CSV file of database targets')
+    parser.add_argument('-c', '--command', type=str, required=True, help='SQL query (or a JSON object of per-type queries)')
+    parser.add_argument('--concurrency', type=int, default=10, help='Targets queried at once')
+    parser.add_argument('--sort', nargs='+', help='Columns to sort by, -name for descending')
+    parser.add_argument('--limit', type=int, help='Stop after this many rows')
+    parser.add_argument('--group-by', nargs='+', help='Columns to group by (source is one)')
+    parser.add_argument('--aggregate', nargs='+', help='name=function:column, function one of count/sum/min/max/avg')
+    args = parser.parse_args()
+
+    command = args.command
+    if command.lstrip().startswith('{'):
+        command = json.loads(command)
+    for kind, record in run_federated(batch.load_inventory(args.inventory), command, args.concurrency, args.sort,
+                                      args.limit, args.group_by, args.aggregate):
+        print(kind, record)
@@ -1,10 +1,30 @@
-import pymysql, cx_Oracle, winrm, paramiko, pymssql
 import argparse
+import codecs
+import copy
 import importlib
+import json
 import os
+import posixpath
+import re
+import socket
+import stat
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from itertools import islice
+
+import columnar
+import drivers
+import metrics
+import pool
+import sessions
+import topology
 
 
 class Base:
+    # resolved address to connect to, set by the pool before connect()
+    address = None
+
     def __init__(self, host, port, user, password):
         self.host = host
         self.port = port
@@ -16,19 +36,62 @@ class Base:
 
     def run(self, raw_input):
         raise ValueError
+
+    def close(self):
+        pass
+
+    def key(self):
+        return (self.type, self.host, self.port, self.user, getattr(self, 'name', ''))
+
+    @contextmanager
+    def borrow(self):
+        self.connect()
+        try:
+            yield self
+        finally:
+            self.close()
     
-    def generate_script(self, raw_input, script_name):
+    def generate_job(self, raw_input, job_name, params=None, watermark=None):
+        # a job spec for runner.py, which imports only the backend it needs
+        job = {'type': self.type, 'host': self.host, 'port': self.port, 'user': self.user, 'password': self.password}
+        if hasattr(self, 'name'):
+            job['name'] = self.name
+        job['command'] = raw_input
+        if params is not None:
+            job['params'] = params
+        if watermark:
+            job['watermark'] = watermark
+        path = job_name if job_name.endswith('.json') else f"{job_name}.json"
+        with open(path, "w") as f:
+            json.dump(job, f, indent=2)
+        print(f"Job generated: {path}")
+
+    def generate_script(self, raw_input, script_name, params=None, watermark=None):
+        if script_name.endswith('.json'):
+            return self.generate_job(raw_input, script_name, params, watermark)
+        has_name = hasattr(self, 'name')
+        name_line = f"name = {self.name!r}\n" if has_name else ""
+        name_arg = "    parser.add_argument('-n', '--name', type=str)\n" if has_name else ""
+        name_override = "    name = args.name if args.name else name\n" if has_name else ""
+        name_param = ", name" if has_name else ""
+        # saved incremental queries only fetch rows past the last watermark
+        watermark_line = f"watermark_spec = {watermark!r}\n" if watermark else ""
+        run_line = ("result = watermark.poll(client, q, watermark_spec, params)" if watermark else
+                    "client.connect()\n    result = client.run(q) if params is None else client.run(q, params)")
+        import_line = "import watermark\n" if watermark else ""
         with open(f"{script_name}.py", "w") as f:
             f.write(f"""import main
 import argparse
-
-q = '{raw_input}'
-type_str = '{self.type}'
-host = '{self.host}'
+import json
+{import_line}
+q = {raw_input!r}
+params = {params!r}
+type_str = {self.type!r}
+host = {self.host!r}
 port = {self.port}
-user = '{self.user}'
-password = '{self.password}'
-
+user = {self.user!r}
+password = {self.password!r}
+{name_line}{watermark_line}
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Command runner')
     parser.add_argument('-t', '--type', type=str)
@@ -37,7 +100,8 @@ if __name__ == '__main__':
     parser.add_argument('-u', '--user', type=str)
     parser.add_argument('-pa', '--password', type=str)
     parser.add_argument('-c', '--command', type=str)
-
+    parser.add_argument('--params', type=str)
+{name_arg}
     args = parser.parse_args()
 
     type_str = args.type if args.type else type_str
@@ -46,18 +110,54 @@ if __name__ == '__main__':
     user = args.user if args.user else user
     password = args.password if args.password else password
     q = args.command if args.command else q
-
+    params = json.loads(args.params) if args.params else params
+{name_override}
     client_class = getattr(main, type_str)
-    client = client_class(host, port, user, password)
-    client.connect()
-    result = client.run(q)
+    client = client_class(host, port, user, password{name_param})
+    {run_line}
     print(result)
 """)
         print(f"Script generated: {script_name}.py")
 
 
 class Client(Base):
-    pass
+    encoding = 'utf-8'
+    stream_limit = 64 * 1024 * 1024
+
+    def output(self, raw_input):
+        raise ValueError("streaming is not supported for this type")
+
+    def stream(self, raw_input, max_bytes=None):
+        # ('stdout' | 'stderr', text) as output arrives, then ('exit', status);
+        # past max_bytes the command is abandoned with ('truncated', max_bytes)
+        max_bytes = max_bytes or self.stream_limit
+        decoders = {name: codecs.getincrementaldecoder(self.encoding)('replace') for name in ('stdout', 'stderr')}
+        total = 0
+        output = self.output(raw_input)
+        try:
+            with metrics.timed('execute', self.type, self.host):
+                for name, data in output:
+                    if name == 'exit':
+                        for stream_name, decoder in decoders.items():
+                            text = decoder.decode(b'', final=True)
+                            if text:
+                                yield stream_name, text
+                        yield name, data
+                        return
+                    if total + len(data) > max_bytes:
+                        text = decoders[name].decode(data[:max_bytes - total], final=True)
+                        total = max_bytes
+                        if text:
+                            yield name, text
+                        yield 'truncated', max_bytes
+                        return
+                    total += len(data)
+                    text = decoders[name].decode(data)
+                    if text:
+                        yield name, text
+        finally:
+            output.close()
+            metrics.count('bytes', self.type, self.host, total)
 
 
 class Windows(Client):
@@ -65,13 +165,70 @@ class Windows(Client):
         super().__init__(host, port, user, password)
         self.type = 'Windows'
 
+    reuse_shell = True
+    encoding = 'cp1252'
+
     def connect(self):
-        self.connection = winrm.Session(f'http://{self.host}:{self.port}/wsman', auth=(f'{self.user}', f'{self.password}'))
-        print(f'http://{self.host}:{self.port}/wsman', ({self.user}, {self.password}))
+        self.connection = sessions.wsman.acquire(self.host, self.port, self.user, self.password)
 
     def run(self, raw_input):
-        result = self.connection.run_cmd(raw_input)
-        return result.std_out.decode(encoding='cp1252')
+        if not self.reuse_shell:
+            with metrics.timed('execute', self.type, self.host):
+                std_out = self.connection.run_cmd(raw_input).std_out
+        else:
+            std_out = self.run_in_shell(raw_input)
+        metrics.count('bytes', self.type, self.host, len(std_out))
+        with metrics.timed('decode', self.type, self.host):
+            return std_out.decode(encoding='cp1252')
+
+    def run_in_shell(self, raw_input):
+        protocol = self.connection.protocol
+        shell_id = sessions.wsman.take_shell(self.host, self.port, self.user, self.password)
+        try:
+            with metrics.timed('execute', self.type, self.host):
+                command_id = protocol.run_command(shell_id, raw_input)
+                try:
+                    std_out, std_err, status_code = protocol.get_command_output(shell_id, command_id)
+                finally:
+                    protocol.cleanup_command(shell_id, command_id)
+        except Exception:
+            sessions.wsman.give_shell(self.host, self.port, self.user, self.password, shell_id, discard=True)
+            raise
+        sessions.wsman.give_shell(self.host, self.port, self.user, self.password, shell_id)
+        return std_out
+
+    def output(self, raw_input):
+        protocol = self.connection.protocol
+        # one Receive per round trip; pywinrm renamed it in 0.5
+        receive = getattr(protocol, 'get_command_output_raw', None) or protocol._raw_get_command_output
+        timeout_error = drivers.load('winrm.exceptions').WinRMOperationTimeoutError
+        shell_id = sessions.wsman.take_shell(self.host, self.port, self.user, self.password)
+        discard = False
+        try:
+            command_id = protocol.run_command(shell_id, raw_input)
+            try:
+                done = False
+                while not done:
+                    try:
+                        std_out, std_err, status_code, done = receive(shell_id, command_id)
+                    except timeout_error:
+                        continue
+                    if std_err:
+                        yield 'stderr', std_err
+                    if std_out:
+                        yield 'stdout', std_out
+                yield 'exit', status_code
+            finally:
+                # also stops a command that is abandoned part way through
+                protocol.cleanup_command(shell_id, command_id)
+        except Exception:
+            discard = True
+            raise
+        finally:
+            sessions.wsman.give_shell(self.host, self.port, self.user, self.password, shell_id, discard=discard)
+
+    def close(self):
+        sessions.wsman.release(self.host, self.port, self.user, self.password)
 
 
 class Linux(Client):
@@ -79,139 +236,581 @@ class Linux(Client):
         super().__init__(host, port, user, password)
         self.type = 'Linux'
 
+    max_channels = 8
+    transfer_chunk = 1024 * 1024
+    transfer_window = 8 * 1024 * 1024
+
     def connect(self):
-        self.connection = paramiko.SSHClient()
-        self.connection.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        self.connection.connect(hostname=self.host, port=self.port, username=self.user, password=self.password)
+        # the transport is shared by every Linux object for this host/user;
+        # each command gets its own channel on it
+        self.connection = sessions.ssh.acquire(self.host, self.port, self.user, self.password)
+
+    def open_channel(self):
+        paramiko = drivers.load('paramiko')
+        try:
+            return self.connection.open_session()
+        except paramiko.SSHException:
+            sessions.ssh.discard(self.host, self.port, self.user, self.password)
+            self.connection = sessions.ssh.acquire(self.host, self.port, self.user, self.password)
+            sessions.ssh.release(self.host, self.port, self.user, self.password)
+            return self.connection.open_session()
 
     def run(self, raw_input):
-        stdin, stdout, stderr = self.connection.exec_command(raw_input)
-        return stdout.read().decode()
+        channel = self.open_channel()
+        try:
+            with metrics.timed('execute', self.type, self.host):
+                channel.exec_command(raw_input)
+                std_out = channel.makefile('rb').read()
+        finally:
+            channel.close()
+        metrics.count('bytes', self.type, self.host, len(std_out))
+        with metrics.timed('decode', self.type, self.host):
+            return std_out.decode()
+
+    def output(self, raw_input, poll=0.1):
+        channel = self.open_channel()
+        try:
+            channel.exec_command(raw_input)
+            channel.settimeout(poll)
+            while True:
+                while channel.recv_stderr_ready():
+                    yield 'stderr', channel.recv_stderr(32768)
+                try:
+                    data = channel.recv(32768)
+                except socket.timeout:
+                    continue
+                if not data:
+                    break
+                yield 'stdout', data
+            # EOF covers both streams, so whatever stderr is left is buffered
+            while True:
+                data = channel.recv_stderr(32768)
+                if not data:
+                    break
+                yield 'stderr', data
+            yield 'exit', channel.recv_exit_status()
+        finally:
+            channel.close()
+
+    def run_many(self, commands):
+        with ThreadPoolExecutor(max_workers=min(self.max_channels, len(commands) or 1)) as executor:
+            return list(executor.map(self.run, commands))
+
+    def open_sftp(self):
+        channel = self.open_channel()
+        channel.invoke_subsystem('sftp')
+        return drivers.load('paramiko').SFTPClient(channel)
+
+    def download(self, remote_path, local_path):
+        # copied into local_path.part, which a later call resumes from, and
+        # renamed into place once complete
+        sftp = self.open_sftp()
+        try:
+            attrs = sftp.stat(remote_path)
+            partial = partial_path(local_path, attrs.st_size, attrs.st_mtime)
+            directory = os.path.dirname(os.path.abspath(local_path))
+            os.makedirs(directory, exist_ok=True)
+            for name in stale_partials(os.listdir(directory), local_path, partial):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+            offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+            if offset > attrs.st_size:
+                offset = 0
+            started = time.perf_counter()
+            with metrics.timed('transfer', self.type, self.host):
+                with sftp.open(remote_path, 'rb') as remote, open(partial, 'ab' if offset else 'wb') as local:
+                    # keeps a window of read requests in flight instead of one
+                    # per round trip; only that window is ever held in memory
+                    position = offset
+                    while position < attrs.st_size:
+                        end = min(position + self.transfer_window, attrs.st_size)
+                        chunks = [(start, min(self.transfer_chunk, end - start))
+                                  for start in range(position, end, self.transfer_chunk)]
+                        for data in remote.readv(chunks):
+                            local.write(data)
+                        position = end
+            os.replace(partial, local_path)
+            os.utime(local_path, (attrs.st_atime, attrs.st_mtime))
+        finally:
+            sftp.close()
+        metrics.count('bytes', self.type, self.host, attrs.st_size - offset)
+        return {'path': remote_path, 'bytes': attrs.st_size - offset, 'resumed_from': offset, 'seconds': time.perf_counter() - started}
+
+    def upload(self, local_path, remote_path):
+        sftp = self.open_sftp()
+        try:
+            source = os.stat(local_path)
+            size = source.st_size
+            partial = partial_path(remote_path, size, source.st_mtime)
+            try:
+                names = sftp.listdir(posixpath.dirname(remote_path) or '.')
+            except IOError:
+                names = []
+            for name in stale_partials(names, remote_path, partial):
+                try:
+                    sftp.remove(posixpath.join(posixpath.dirname(remote_path), name))
+                except IOError:
+                    pass
+            try:
+                offset = sftp.stat(partial).st_size
+            except IOError:
+                offset = 0
+            if offset > size:
+                offset = 0
+            started = time.perf_counter()
+            with metrics.timed('transfer', self.type, self.host):
+                with open(local_path, 'rb') as local, sftp.open(partial, 'ab' if offset else 'wb') as remote:
+                    # writes are acknowledged in the background rather than one at a time
+                    remote.set_pipelined(True)
+                    local.seek(offset)
+                    while True:
+                        data = local.read(self.transfer_chunk)
+                        if not data:
+                            break
+                        remote.write(data)
+            try:
+                sftp.posix_rename(partial, remote_path)
+            except IOError:
+                # servers without the posix-rename extension refuse to overwrite
+                try:
+                    sftp.remove(remote_path)
+                except IOError:
+                    pass
+                sftp.rename(partial, remote_path)
+            sftp.utime(remote_path, (source.st_atime, source.st_mtime))
+        finally:
+            sftp.close()
+        metrics.count('bytes', self.type, self.host, size - offset)
+        return {'path': local_path, 'bytes': size - offset, 'resumed_from': offset, 'seconds': time.perf_counter() - started}
+
+    def transfer_many(self, method, pairs):
+        # several files in flight, each on its own channel of the shared transport
+        with ThreadPoolExecutor(max_workers=min(self.max_channels, len(pairs) or 1)) as executor:
+            return list(executor.map(lambda pair: method(*pair), pairs))
+
+    def download_dir(self, remote_dir, local_dir):
+        # recursive sync: files whose size and mtime already match are skipped
+        pairs = []
+        skipped = []
+        sftp = self.open_sftp()
+        try:
+            pending = [remote_dir]
+            while pending:
+                directory = pending.pop()
+                for attrs in sftp.listdir_attr(directory):
+                    remote_path = posixpath.join(directory, attrs.filename)
+                    local_path = os.path.join(local_dir, *posixpath.relpath(remote_path, remote_dir).split('/'))
+                    if stat.S_ISDIR(attrs.st_mode):
+                        pending.append(remote_path)
+                    elif attrs.filename.endswith('.part'):
+                        continue
+                    elif same_file(local_path, attrs):
+                        skipped.append({'path': remote_path, 'skipped': True})
+                    else:
+                        pairs.append((remote_path, local_path))
+        finally:
+            sftp.close()
+        return self.transfer_many(self.download, pairs) + skipped
+
+    def upload_dir(self, local_dir, remote_dir):
+        pairs = []
+        skipped = []
+        sftp = self.open_sftp()
+        try:
+            for directory, _, filenames in os.walk(local_dir):
+                relative = os.path.relpath(directory, local_dir)
+                target = remote_dir if relative == '.' else posixpath.join(remote_dir, *relative.split(os.sep))
+                try:
+                    sftp.mkdir(target)
+                except IOError:
+                    pass
+                for filename in filenames:
+                    if filename.endswith('.part'):
+                        continue
+                    local_path = os.path.join(directory, filename)
+                    remote_path = posixpath.join(target, filename)
+                    try:
+                        attrs = sftp.stat(remote_path)
+                    except IOError:
+                        attrs = None
+                    if attrs is not None and same_file(local_path, attrs):
+                        skipped.append({'path': local_path, 'skipped': True})
+                    else:
+                        pairs.append((local_path, remote_path))
+        finally:
+            sftp.close()
+        return self.transfer_many(self.upload, pairs) + skipped
+
+    def close(self):
+        sessions.ssh.release(self.host, self.port, self.user, self.password)
 
 
 class Database(Base):
-    def run(self, raw_input):
-        self.cursor.execute(raw_input)
-        raw_results = self.cursor.fetchall()
+    ping_query = 'SELECT 1'
+    batch_size = 1000
+    streaming = None
+    # '\' escapes a quote inside a string literal (MySQL, not standard SQL)
+    backslash_escapes = False
+
+    def run(self, raw_input, params=None, stream=False, batch_size=None):
+        if stream:
+            return self.stream(raw_input, batch_size, params)
+        with metrics.timed('execute', self.type, self.host):
+            self.execute(self.cursor, raw_input, params)
+        self.description = self.cursor.description
+        with metrics.timed('fetch', self.type, self.host):
+            raw_results = self.cursor.fetchall()
+        metrics.count('rows', self.type, self.host, len(raw_results))
         return raw_results
 
+    def run_columnar(self, raw_input, params=None, batch_size=None):
+        # typed column buffers instead of a tuple per row, filled batch by
+        # batch so the full list of tuples never exists at once
+        batches = self.stream(raw_input, batch_size, params)
+        return columnar.ColumnarResult.from_batches([desc[0] for desc in self.description], batches)
+
+    def placeholder(self, index):
+        return '%s'
+
+    def execute(self, cursor, raw_input, params=None):
+        # bind parameters travel separately from the statement text, so the
+        # text stays the same across calls and the server can reuse its plan
+        if params is None:
+            cursor.execute(raw_input)
+        else:
+            cursor.execute(raw_input, tuple(params) if isinstance(params, list) else params)
+
+    def stream_cursor(self, batch_size):
+        return self.connection.cursor()
+
+    def stream(self, raw_input, batch_size=None, params=None):
+        # executes right away so the column names are known before the
+        # first batch is pulled; rows are then fetched batch_size at a time
+        batch_size = batch_size or self.batch_size
+        self.close_stream()
+        cursor = self.stream_cursor(batch_size)
+        self.streaming = cursor
+        with metrics.timed('execute', self.type, self.host):
+            self.execute(cursor, raw_input, params)
+        self.description = cursor.description
+        return self.batches(cursor, batch_size)
+
+    def batches(self, cursor, batch_size):
+        try:
+            while True:
+                with metrics.timed('fetch', self.type, self.host):
+                    rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                metrics.count('rows', self.type, self.host, len(rows))
+                yield rows
+        finally:
+            if self.streaming is cursor:
+                self.close_stream()
+
+    def close_stream(self):
+        cursor, self.streaming = self.streaming, None
+        if cursor is not None:
+            cursor.close()
+
+    def executemany(self, statement, rows):
+        self.cursor.executemany(statement, rows)
+        return self.cursor.rowcount
+
+    def run_bulk(self, statement, params, batch_size=None):
+        # one transaction, batch_size parameter rows per round trip
+        batch_size = batch_size or self.batch_size
+        params = iter(params)
+        report = []
+        try:
+            while True:
+                rows = list(islice(params, batch_size))
+                if not rows:
+                    break
+                started = time.perf_counter()
+                count = self.executemany(statement, rows)
+                report.append({'batch': len(report), 'rows': count, 'seconds': time.perf_counter() - started})
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        return report
+
+    def split_script(self, script):
+        if re.search(r'^\s*/\s*$', script, re.MULTILINE):
+            statements = re.split(r'^\s*/\s*$', script, flags=re.MULTILINE)
+        else:
+            statements = split_statements(script, backslash_escapes=self.backslash_escapes)
+        return [statement.strip() for statement in statements if statement.strip()]
+
+    def run_script(self, script):
+        report = []
+        try:
+            for statement in self.split_script(script):
+                started = time.perf_counter()
+                self.cursor.execute(statement)
+                report.append({'statement': len(report), 'rows': self.cursor.rowcount, 'seconds': time.perf_counter() - started})
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        return report
+
+    def ping(self):
+        try:
+            self.cursor.execute(self.ping_query)
+            self.cursor.fetchall()
+            return True
+        except Exception:
+            return False
+
+    def reset(self):
+        self.close_stream()
+        self.connection.rollback()
+
+    def close(self):
+        try:
+            self.close_stream()
+            self.cursor.close()
+        finally:
+            self.connection.close()
+
+    @contextmanager
+    def borrow(self, **options):
+        with pool.get_pool(self, **options).connection() as db:
+            yield db
+
 
 class Mysql(Database):
+    backslash_escapes = True
+
     def __init__(self, host, port, user, password):
         super().__init__(host, port, user, password)
         self.type = 'Mysql'
 
     def connect(self):
-        connection = pymysql.connect(host=self.host, user=self.user, password=self.password, port=self.port)
-        self.cursor = connection.cursor()
+        pymysql = drivers.load('pymysql')
+        self.connection = pymysql.connect(host=self.address or self.host, user=self.user, password=self.password, port=self.port)
+        self.cursor = self.connection.cursor()
+
+    def ping(self):
+        try:
+            self.connection.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
     
-    def run(self, raw_input):
-        raw_results = super().run(raw_input)
-        column_names = [desc[0] for desc in self.cursor.description]
+    def stream_cursor(self, batch_size):
+        # unbuffered: rows stay on the server until fetchmany asks for them
+        return self.connection.cursor(drivers.load('pymysql.cursors').SSCursor)
+
+    def run(self, raw_input, params=None, stream=False, batch_size=None):
+        raw_results = super().run(raw_input, params, stream, batch_size)
+        column_names = [desc[0] for desc in self.description]
         return column_names, raw_results
 
 
 class Oracle(Database):
+    ping_query = 'SELECT 1 FROM DUAL'
+    stmtcachesize = 100
+
     def __init__(self, host, port, user, password, name):
         super().__init__(host, port, user, password)
         self.name = name
         self.type = 'Oracle'
 
     def connect(self):
-        dsn = cx_Oracle.makedsn(self.host, self.port, self.name)
-        connection = cx_Oracle.connect(self.user, self.password, dsn=dsn)
-        self.cursor = connection.cursor()
-
-    def generate_script(self, raw_input, script_name):
-        with open(f"{script_name}.py", "w") as f:
-            f.write(f"""import main
-import argparse
-
-q = '{raw_input}'
-type_str = '{self.type}'
-host = '{self.host}'
-port = {self.port}
-user = '{self.user}'
-password = '{self.password}'
-name = '{self.name}'
-
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='Command runner')
-    parser.add_argument('-t', '--type', type=str)
-    parser.add_argument('-ho', '--host', type=str)
-    parser.add_argument('-po', '--port', type=int)
-    parser.add_argument('-u', '--user', type=str)
-    parser.add_argument('-pa', '--password', type=str)
-    parser.add_argument('-c', '--command', type=str)
-    parser.add_argument('-n', '--name', type=str)
-    
-    args = parser.parse_args()
-
-    type_str = args.type if args.type else type_str
-    host = args.host if args.host else host
-    port = args.port if args.port else port
-    user = args.user if args.user else user
-    password = args.password if args.password else password
-    q = args.command if args.command else q
-    name = args.name if args.name else name
-
-    client_class = getattr(main, type_str)
-    client = client_class(host, port, user, password, name)
-    client.connect()
-    result = client.run(q)
-    print(result)
-""")
+        cx_Oracle = drivers.load('cx_Oracle')
+        dsn = cx_Oracle.makedsn(self.address or self.host, self.port, self.name)
+        self.connection = cx_Oracle.connect(self.user, self.password, dsn=dsn)
+        # repeated statement text is found in the client statement cache and
+        # skips the parse round trip; pooled connections keep it warm
+        self.connection.stmtcachesize = self.stmtcachesize
+        self.cursor = self.connection.cursor()
+
+    def ping(self):
+        try:
+            self.connection.ping()
+            return True
+        except Exception:
+            return False
+
+    def placeholder(self, index):
+        return f':{index + 1}'
+
+    def stream_cursor(self, batch_size):
+        cursor = self.connection.cursor()
+        cursor.arraysize = batch_size
+        if hasattr(cursor, 'prefetchrows'):
+            cursor.prefetchrows = batch_size + 1
+        return cursor
 
 
 class Sqlserver(Database):
-    def __init__(self, host, port, user, password, name):
+    refresh_interval = topology.REFRESH_INTERVAL
+
+    def __init__(self, host, port, user, password, name, replicas=None, read_only=False):
         super().__init__(host, port, user, password)
         self.name = name
         self.type = 'Sqlserver'
+        # AlwaysOn: host is the listener; replicas is a list of 'host[:port]'
+        # seeds or a {replica_server_name: 'host[:port]'} map
+        self.replicas = replicas
+        self.read_only = read_only
+
+    def replica(self, host, port):
+        client = copy.copy(self)
+        client.host, client.port = host, port
+        client.replicas = None
+        client.address = None
+        return client
+
+    def seeds(self):
+        replicas = self.replicas.values() if isinstance(self.replicas, dict) else self.replicas or []
+        return [(self.host, self.port)] + [topology.parse_address(replica, self.port) for replica in replicas]
+
+    def replica_address(self, server_name, routing_url=None):
+        if isinstance(self.replicas, dict) and server_name in self.replicas:
+            return topology.parse_address(self.replicas[server_name], self.port)
+        return topology.parse_address(routing_url or server_name, self.port)
+
+    @contextmanager
+    def borrow(self, read_only=None, **options):
+        if not self.replicas:
+            with super().borrow(**options) as db:
+                yield db
+            return
+        # writes go to the primary and read-only work to the least busy
+        # readable secondary, both addressed directly rather than through
+        # the listener; pymssql cannot ask the listener for read intent
+        read_only = self.read_only if read_only is None else read_only
+        layout = topology.get(self)
+        with ExitStack() as stack:
+            try:
+                address = layout.choose(read_only)
+                stack.callback(layout.done, address)
+                db = stack.enter_context(self.replica(*address).borrow(**options))
+            except pool.PoolTimeout:
+                raise
+            except Exception:
+                # the replica is gone, most likely a failover: rediscover once
+                stack.close()
+                layout = topology.get(self, force=True)
+                address = layout.choose(read_only)
+                stack.callback(layout.done, address)
+                db = stack.enter_context(self.replica(*address).borrow(**options))
+            pymssql = drivers.load('pymssql')
+            try:
+                yield db
+            except (pymssql.OperationalError, pymssql.InterfaceError):
+                topology.invalidate(self)
+                raise
 
     def connect(self):
-        connection = pymssql.connect(server=self.host, port=self.port, user=self.user, password=self.password, database=self.name)
-        self.cursor = connection.cursor()
-
-    def generate_script(self, raw_input, script_name):
-        with open(f"{script_name}.py", "w") as f:
-            f.write(f"""import main
-import argparse
-
-q = '{raw_input}'
-type_str = '{self.type}'
-host = '{self.host}'
-port = {self.port}
-user = '{self.user}'
-password = '{self.password}'
-name = '{self.name}'
-
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='Command runner')
-    parser.add_argument('-t', '--type', type=str)
-    parser.add_argument('-ho', '--host', type=str)
-    parser.add_argument('-po', '--port', type=int)
-    parser.add_argument('-u', '--user', type=str)
-    parser.add_argument('-pa', '--password', type=str)
-    parser.add_argument('-c', '--command', type=str)
-    parser.add_argument('-n', '--name', type=str)
-    
-    args = parser.parse_args()
-
-    type_str = args.type if args.type else type_str
-    host = args.host if args.host else host
-    port = args.port if args.port else port
-    user = args.user if args.user else user
-    password = args.password if args.password else password
-    q = args.command if args.command else q
-    name = args.name if args.name else name
-
-    client_class = getattr(main, type_str)
-    client = client_class(host, port, user, password, name)
-    client.connect()
-    result = client.run(q)
-    print(result)
-""")
+        pymssql = drivers.load('pymssql')
+        self.connection = pymssql.connect(server=self.address or self.host, port=self.port, user=self.user, password=self.password, database=self.name)
+        self.cursor = self.connection.cursor()
+
+    def stream_cursor(self, batch_size):
+        # pymssql reads rows off the TDS stream as they are fetched
+        return self.connection.cursor(as_dict=False)
+
+    def executemany(self, statement, rows):
+        # pymssql's executemany is one round trip per row; send the whole
+        # batch as a single T-SQL batch and count the rows server side
+        substitute_params = drivers.load('pymssql._mssql').substitute_params
+        lines = ['DECLARE @rows INT = 0']
+        for row in rows:
+            query = substitute_params(statement, tuple(row) if isinstance(row, list) else row)
+            lines.append(query.decode() if isinstance(query, bytes) else query)
+            lines.append('SET @rows += @@ROWCOUNT')
+        lines.append('SELECT @rows')
+        self.cursor.execute('\n'.join(lines))
+        return self.cursor.fetchone()[0]
+
+    def split_script(self, script):
+        # each GO-separated batch goes to the server in one round trip
+        batches = re.split(r'^\s*GO\s*$', script, flags=re.MULTILINE | re.IGNORECASE)
+        return [batch.strip() for batch in batches if batch.strip()]
+
+
+def partial_path(path, size, mtime):
+    # the source's size and mtime are in the name, so a transfer only ever
+    # resumes a partial copy of the same version of the file
+    return f'{path}.{size}-{int(mtime)}.part'
+
+
+def stale_partials(names, path, current):
+    # partial copies of other versions of path, and the older plain '.part'
+    pattern = re.compile(re.escape(os.path.basename(path)) + r'(\.\d+-\d+)?\.part$')
+    return [name for name in names if pattern.match(name) and name != os.path.basename(current)]
+
+
+def same_file(local_path, attrs):
+    try:
+        local = os.stat(local_path)
+    except OSError:
+        return False
+    return local.st_size == attrs.st_size and int(local.st_mtime) == int(attrs.st_mtime)
+
+
+def split_statements(script, delimiter=';', backslash_escapes=False):
+    # splits on the delimiter outside of quotes and comments; -- comments are
+    # dropped, /* */ ones kept since MySQL runs /*! */ sections and hints
+    statements = []
+    current = []
+    quote = None
+    i = 0
+    while i < len(script):
+        char = script[i]
+        if quote:
+            current.append(char)
+            if char == '\\' and backslash_escapes and quote != '`' and i + 1 < len(script):
+                current.append(script[i + 1])
+                i += 2
+                continue
+            if char == quote:
+                quote = None
+        elif char in ("'", '"', '`'):
+            quote = char
+            current.append(char)
+        elif script.startswith('/*', i):
+            end = script.find('*/', i + 2)
+            end = len(script) if end == -1 else end + 2
+            current.append(script[i:end])
+            i = end
+            continue
+        elif script.startswith('--', i):
+            end = script.find('\n', i)
+            i = len(script) if end == -1 else end
+            continue
+        elif script.startswith(delimiter, i):
+            statements.append(''.join(current))
+            current = []
+            i += len(delimiter)
+            continue
+        else:
+            current.append(char)
+        i += 1
+    statements.append(''.join(current))
+    return [statement.strip() for statement in statements if statement.strip()]
+
+
+def create_client(cmd_type, host, port, user, password, name='', replicas=None, read_only=False):
+    cmd_type = str(cmd_type).lower()
+    if cmd_type == 'mysql':
+        return Mysql(host, port, user, password)
+    elif cmd_type == 'oracle':
+        return Oracle(host, port, user, password, name)
+    elif cmd_type == 'sqlserver':
+        return Sqlserver(host, port, user, password, name, replicas, read_only)
+    elif cmd_type == 'windows':
+        return Windows(host, port, user, password)
+    elif cmd_type == 'linux':
+        return Linux(host, port, user, password)
+    return None
 
 
 def handle_client(input_type):
@@ -1,245 +1,127 @@
-import pymysql, cx_Oracle, winrm, paramiko, pymssql
 import argparse
 import importlib
+import json
 import os
+import sys
 
+import batch
+import export
+import registry
+import runner
+import topology
+import watermark
+from main import Client, Database, Mysql, Oracle, Sqlserver, Windows, Linux
 
-class Base:
-    def __init__(self, host, port, user, password):
-        self.host = host
-        self.port = port
-        self.user = user
-        self.password = password
 
-    def connect(self):
-        raise ValueError
-
-    def run(self, raw_input):
-        raise ValueError
-    
-    def generate_script(self, raw_input, script_name):
-        with open(f"{script_name}.py", "w") as f:
-            f.write(f"""import main
-import argparse
-
-q = '{raw_input}'
-type_str = '{self.type}'
-host = '{self.host}'
-port = {self.port}
-user = '{self.user}'
-password = '{self.password}'
-
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='Command runner')
-    parser.add_argument('-t', '--type', type=str)
-    parser.add_argument('-ho', '--host', type=str)
-    parser.add_argument('-po', '--port', type=int)
-    parser.add_argument('-u', '--user', type=str)
-    parser.add_argument('-pa', '--password', type=str)
-    parser.add_argument('-c', '--command', type=str)
-
-    args = parser.parse_args()
-
-    type_str = args.type if args.type else type_str
-    host = args.host if args.host else host
-    port = args.port if args.port else port
-    user = args.user if args.user else user
-    password = args.password if args.password else password
-    q = args.command if args.command else q
-
-    client_class = getattr(main, type_str)
-    client = client_class(host, port, user, password)
-    client.connect()
-    result = client.run(q)
-    print(result)
-""")
-        print(f"Script generated: {script_name}.py")
-
-
-class Client(Base):
-    pass
-
-
-class Windows(Client):
-    def __init__(self, host, port, user, password):
-        super().__init__(host, port, user, password)
-        self.type = 'Windows'
-
-    def connect(self):
-        self.connection = winrm.Session(f'http://{self.host}:{self.port}/wsman', auth=(f'{self.user}', f'{self.password}'))
-        print(f'http://{self.host}:{self.port}/wsman', ({self.user}, {self.password}))
-
-    def run(self, raw_input):
-        result = self.connection.run_cmd(raw_input)
-        return result.std_out.decode(encoding='cp1252')
-
-
-class Linux(Client):
-    def __init__(self, host, port, user, password):
-        super().__init__(host, port, user, password)
-        self.type = 'Linux'
-
-    def connect(self):
-        self.connection = paramiko.SSHClient()
-        self.connection.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        self.connection.connect(hostname=self.host, port=self.port, username=self.user, password=self.password)
-
-    def run(self, raw_input):
-        stdin, stdout, stderr = self.connection.exec_command(raw_input)
-        return stdout.read().decode()
-
-
-class Database(Base):
-    def run(self, raw_input):
-        self.cursor.execute(raw_input)
-        raw_results = self.cursor.fetchall()
-        return raw_results
-
-
-class Mysql(Database):
-    def __init__(self, host, port, user, password):
-        super().__init__(host, port, user, password)
-        self.type = 'Mysql'
-
-    def connect(self):
-        connection = pymysql.connect(host=self.host, user=self.user, password=self.password, port=self.port)
-        self.cursor = connection.cursor()
-    
-    def run(self, raw_input):
-        raw_results = super().run(raw_input)
-        column_names = [desc[0] for desc in self.cursor.description]
-        return column_names, raw_results
-
-
-class Oracle(Database):
-    def __init__(self, host, port, user, password, name):
-        super().__init__(host, port, user, password)
-        self.name = name
-        self.type = 'Oracle'
-
-    def connect(self):
-        dsn = cx_Oracle.makedsn(self.host, self.port, self.name)
-        connection = cx_Oracle.connect(self.user, self.password, dsn=dsn)
-        self.cursor = connection.cursor()
-
-    def generate_script(self, raw_input, script_name):
-        with open(f"{script_name}.py", "w") as f:
-            f.write(f"""import main
-import argparse
-
-q = '{raw_input}'
-type_str = '{self.type}'
-host = '{self.host}'
-port = {self.port}
-user = '{self.user}'
-password = '{self.password}'
-name = '{self.name}'
-
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='Command runner')
-    parser.add_argument('-t', '--type', type=str)
-    parser.add_argument('-ho', '--host', type=str)
-    parser.add_argument('-po', '--port', type=int)
-    parser.add_argument('-u', '--user', type=str)
-    parser.add_argument('-pa', '--password', type=str)
-    parser.add_argument('-c', '--command', type=str)
-    parser.add_argument('-n', '--name', type=str)
-    
-    args = parser.parse_args()
-
-    type_str = args.type if args.type else type_str
-    host = args.host if args.host else host
-    port = args.port if args.port else port
-    user = args.user if args.user else user
-    password = args.password if args.password else password
-    q = args.command if args.command else q
-    name = args.name if args.name else name
-
-    client_class = getattr(main, type_str)
-    client = client_class(host, port, user, password, name)
-    client.connect()
-    result = client.run(q)
-    print(result)
-""")
-        print(f"Script generated: {script_name}.py")
-
-
-class Sqlserver(Database):
-    def __init__(self, host, port, user, password, name):
-        super().__init__(host, port, user, password)
-        self.name = name
-        self.type = 'Sqlserver'
-
-    def connect(self):
-        connection = pymssql.connect(server=self.host, port=self.port, user=self.user, password=self.password, database=self.name)
-        self.cursor = connection.cursor()
-
-    def generate_script(self, raw_input, script_name):
-        with open(f"{script_name}.py", "w") as f:
-            f.write(f"""import main
-import argparse
-
-q = '{raw_input}'
-type_str = '{self.type}'
-host = '{self.host}'
-port = {self.port}
-user = '{self.user}'
-password = '{self.password}'
-name = '{self.name}'
-
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='Command runner')
-    parser.add_argument('-t', '--type', type=str)
-    parser.add_argument('-ho', '--host', type=str)
-    parser.add_argument('-po', '--port', type=int)
-    parser.add_argument('-u', '--user', type=str)
-    parser.add_argument('-pa', '--password', type=str)
-    parser.add_argument('-c', '--command', type=str)
-    parser.add_argument('-n', '--name', type=str)
-    
-    args = parser.parse_args()
-
-    type_str = args.type if args.type else type_str
-    host = args.host if args.host else host
-    port = args.port if args.port else port
-    user = args.user if args.user else user
-    password = args.password if args.password else password
-    q = args.command if args.command else q
-    name = args.name if args.name else name
-
-    client_class = getattr(main, type_str)
-    client = client_class(host, port, user, password, name)
-    client.connect()
-    result = client.run(q)
-    print(result)
-""")
-        print(f"Script generated: {script_name}.py")
+def print_stream(object, result):
+    if isinstance(object, Mysql):
+        column_names, result = result
+        print(column_names)
+    for rows in result:
+        for row in rows:
+            print(row)
 
 
 def handle_argument(args):
     try:
+        if args.file and args.file.endswith('.json'):
+            for record in runner.run_jobs([args.file], args.concurrency, args.timeout):
+                print(record)
+            return
         if args.file:
             module = importlib.import_module(os.path.splitext(args.file)[0])
             print(module.q)
             exit()
+        if args.inventory:
+            for record in batch.run_batch(batch.load_inventory(args.inventory), args.command, args.concurrency, args.timeout):
+                print(record)
+            return
+        if args.target:
+            entry = registry.load(args.targets).get(args.target)
+            for field in ('type', 'host', 'port', 'user', 'password', 'name'):
+                if getattr(args, field) is None and entry.get(field) not in (None, ''):
+                    setattr(args, field, entry[field])
+            args.type = str(args.type).lower()
         if args.type == 'mysql':
             object = Mysql(args.host, args.port, args.user, args.password)
             print(args.host, args.port, args.user, args.password)
         elif args.type == 'oracle':
             object = Oracle(args.host, args.port, args.user, args.password, args.name)
         elif args.type == "sqlserver":
-            object = Sqlserver(args.host, args.port, args.user, args.password, args.name)
+            object = Sqlserver(args.host, args.port, args.user, args.password, args.name,
+                               topology.parse_replicas(args.replicas), args.read_only)
         elif args.type == "windows":
             object = Windows(args.host, args.port, args.user, args.password)
         elif args.type == "linux":
             object = Linux(args.host, args.port, args.user, args.password)
         else:
             exit("wrong type, please try again")
-        object.connect()
-        result = object.run(args.command)
+        params = json.loads(args.params) if args.params else None
+        if (args.download or args.upload) and isinstance(object, Linux):
+            with object.borrow() as conn:
+                if args.download:
+                    method = conn.download_dir if args.recursive else conn.download
+                    report = method(*args.download)
+                else:
+                    method = conn.upload_dir if args.recursive else conn.upload
+                    report = method(*args.upload)
+            for entry in report if isinstance(report, list) else [report]:
+                print(entry)
+            return
+        if (args.rows or args.script) and isinstance(object, Database):
+            with object.borrow() as conn:
+                if args.script:
+                    with open(args.script) as f:
+                        report = conn.run_script(f.read())
+                else:
+                    with open(args.rows) as f:
+                        report = conn.run_bulk(args.command, json.load(f), args.batch_size)
+            for entry in report:
+                print(entry)
+            return
+        if args.format and isinstance(object, Database):
+            with object.borrow() as conn:
+                batches = conn.stream(args.command, args.batch_size, params)
+                chunks = export.export(args.format, [desc[0] for desc in conn.description], batches, args.compress)
+                if args.output:
+                    with open(args.output, 'wb') as f:
+                        f.writelines(chunks)
+                else:
+                    sys.stdout.buffer.writelines(chunks)
+                    sys.stdout.buffer.flush()
+            return
+        if args.watermark and isinstance(object, Database):
+            result = watermark.poll(object, args.command, args.watermark, params)
+            print(result['columns'])
+            for row in result['rows']:
+                print(row)
+            print(f"{result['count']} new rows, watermark {result['previous']} -> {result['watermark']}")
+            if args.action:
+                object.generate_script(args.command, args.action, params, args.watermark)
+            return
+        if args.stream and isinstance(object, Client):
+            with object.borrow() as conn:
+                for name, value in conn.stream(args.command, args.max_bytes):
+                    if name == 'stdout':
+                        sys.stdout.write(value)
+                        sys.stdout.flush()
+                    elif name == 'stderr':
+                        sys.stderr.write(value)
+                        sys.stderr.flush()
+                    elif name == 'truncated':
+                        print(f"\nOutput truncated after {value} bytes", file=sys.stderr)
+                    else:
+                        print(f"\nExit status: {value}", file=sys.stderr)
+            return
+        if args.stream and isinstance(object, Database):
+            with object.borrow() as conn:
+                print_stream(object, conn.run(args.command, params, stream=True, batch_size=args.batch_size))
+            return
+        with object.borrow() as conn:
+            result = conn.run(args.command) if params is None else conn.run(args.command, params)
         print(result)
         if args.action:
-            object.generate_script(args.command, args.action)
+            object.generate_script(args.command, args.action, params)
 
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -254,8 +136,28 @@ if __name__ == "__main__":
     parser.add_argument('-pa', '--password', type=str, help='Password')
     parser.add_argument('-n', '--name', type = str, help='Name')
     parser.add_argument('-c', '--command', type=str, help='SQL/CMD Command')
-    parser.add_argument('-a', '--action', type=str, help='Generate file name')
-    parser.add_argument('-f', '--file', type=str, help='Run that file')
+    parser.add_argument('-a', '--action', type=str, help='Generate file name (a .json name writes a job spec)')
+    parser.add_argument('-f', '--file', type=str, help='Run that file (.json job specs are executed)')
+    parser.add_argument('-s', '--stream', action='store_true', help='Print rows or command output as they arrive')
+    parser.add_argument('--max-bytes', type=int, help='Stop a streamed command after this much output')
+    parser.add_argument('-b', '--batch-size', type=int, help='Rows per fetch when streaming')
+    parser.add_argument('--format', type=str, choices=list(export.FORMATS), help='Write rows in this format as they are fetched')
+    parser.add_argument('-o', '--output', type=str, help='File to write --format output to (default stdout)')
+    parser.add_argument('--compress', type=str, choices=export.ENCODINGS, help='Compress --format output')
+    parser.add_argument('--replicas', type=str, help='SQL Server AlwaysOn: host is the listener, these are the replicas (host[:port],...)')
+    parser.add_argument('--read-only', action='store_true', help='SQL Server AlwaysOn: run on the least busy readable secondary')
+    parser.add_argument('--watermark', type=str, help='Only fetch rows past the last run: column[:timestamp|rowversion|scn|number] or a JSON spec')
+    parser.add_argument('--params', type=str, help='JSON list/object of bind parameters for the command')
+    parser.add_argument('-r', '--rows', type=str, help='JSON file of parameter rows to run the command with in batches')
+    parser.add_argument('--script', type=str, help='SQL script file to run in one transaction')
+    parser.add_argument('--download', nargs=2, metavar=('REMOTE', 'LOCAL'), help='Copy a file from a Linux host over SFTP')
+    parser.add_argument('--upload', nargs=2, metavar=('LOCAL', 'REMOTE'), help='Copy a file to a Linux host over SFTP')
+    parser.add_argument('-R', '--recursive', action='store_true', help='Sync whole directories with --download/--upload')
+    parser.add_argument('--targets', type=str, default=os.environ.get('TARGETS', 'targets.json'), help='Target registry file (JSON/CSV)')
+    parser.add_argument('--target', type=str, help='Take type/host/port/user/password/name from this registry entry')
+    parser.add_argument('-i', '--inventory', type=str, help='Run on every target in this JSON/CSV file')
+    parser.add_argument('--concurrency', type=int, default=10, help='Targets run at once with --inventory')
+    parser.add_argument('--timeout', type=float, default=60, help='Per-target timeout in seconds with --inventory')
 
     args = parser.parse_args()
 
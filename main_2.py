@@ -1,221 +1,102 @@
-from flask import Flask, request, jsonify, render_template
-import pymysql, cx_Oracle, winrm, paramiko, pymssql
-
-
-class Base:
-    def __init__(self, host, port, user, password):
-        self.host = host
-        self.port = port
-        self.user = user
-        self.password = password
-
-    def connect(self):
-        raise ValueError
-
-    def run(self, raw_input):
-        raise ValueError
-    
-    def generate_script(self, raw_input, script_name):
-        with open(f"{script_name}.py", "w") as f:
-            f.write(f"""import main
-import argparse
-
-q = '{raw_input}'
-type_str = '{self.type}'
-host = '{self.host}'
-port = {self.port}
-user = '{self.user}'
-password = '{self.password}'
+import json
+from contextlib import ExitStack
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='Command runner')
-    parser.add_argument('-t', '--type', type=str)
-    parser.add_argument('-ho', '--host', type=str)
-    parser.add_argument('-po', '--port', type=int)
-    parser.add_argument('-u', '--user', type=str)
-    parser.add_argument('-pa', '--password', type=str)
-    parser.add_argument('-c', '--command', type=str)
-
-    args = parser.parse_args()
-
-    type_str = args.type if args.type else type_str
-    host = args.host if args.host else host
-    port = args.port if args.port else port
-    user = args.user if args.user else user
-    password = args.password if args.password else password
-    q = args.command if args.command else q
-
-    client_class = getattr(main, type_str)
-    client = client_class(host, port, user, password)
-    client.connect()
-    result = client.run(q)
-    print(result)
-""")
-        print(f"Script generated: {script_name}.py")
-
-
-class Client(Base):
-    pass
-
-
-class Windows(Client):
-    def __init__(self, host, port, user, password):
-        super().__init__(host, port, user, password)
-        self.type = 'Windows'
-
-    def connect(self):
-        self.connection = winrm.Session(f'http://{self.host}:{self.port}/wsman', auth=(f'{self.user}', f'{self.password}'))
-        print(f'http://{self.host}:{self.port}/wsman', ({self.user}, {self.password}))
-
-    def run(self, raw_input):
-        result = self.connection.run_cmd(raw_input)
-        return result.std_out.decode(encoding='cp1252')
-
-
-class Linux(Client):
-    def __init__(self, host, port, user, password):
-        super().__init__(host, port, user, password)
-        self.type = 'Linux'
-
-    def connect(self):
-        self.connection = paramiko.SSHClient()
-        self.connection.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        self.connection.connect(hostname=self.host, port=self.port, username=self.user, password=self.password)
-
-    def run(self, raw_input):
-        stdin, stdout, stderr = self.connection.exec_command(raw_input)
-        return stdout.read().decode()
-
-
-class Database(Base):
-    def run(self, raw_input):
-        self.cursor.execute(raw_input)
-        raw_results = self.cursor.fetchall()
-        return raw_results
-
-
-class Mysql(Database):
-    def __init__(self, host, port, user, password):
-        super().__init__(host, port, user, password)
-        self.type = 'Mysql'
-
-    def connect(self):
-        connection = pymysql.connect(host=self.host, user=self.user, password=self.password, port=self.port)
-        self.cursor = connection.cursor()
-    
-    def run(self, raw_input):
-        raw_results = super().run(raw_input)
-        column_names = [desc[0] for desc in self.cursor.description]
-        return column_names, raw_results
-
-
-class Oracle(Database):
-    def __init__(self, host, port, user, password, name):
-        super().__init__(host, port, user, password)
-        self.name = name
-        self.type = 'Oracle'
-
-    def connect(self):
-        dsn = cx_Oracle.makedsn(self.host, self.port, self.name)
-        connection = cx_Oracle.connect(self.user, self.password, dsn=dsn)
-        self.cursor = connection.cursor()
-
-    def generate_script(self, raw_input, script_name):
-        with open(f"{script_name}.py", "w") as f:
-            f.write(f"""import main
-import argparse
-
-q = '{raw_input}'
-type_str = '{self.type}'
-host = '{self.host}'
-port = {self.port}
-user = '{self.user}'
-password = '{self.password}'
-name = '{self.name}'
-
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='Command runner')
-    parser.add_argument('-t', '--type', type=str)
-    parser.add_argument('-ho', '--host', type=str)
-    parser.add_argument('-po', '--port', type=int)
-    parser.add_argument('-u', '--user', type=str)
-    parser.add_argument('-pa', '--password', type=str)
-    parser.add_argument('-c', '--command', type=str)
-    parser.add_argument('-n', '--name', type=str)
-    
-    args = parser.parse_args()
-
-    type_str = args.type if args.type else type_str
-    host = args.host if args.host else host
-    port = args.port if args.port else port
-    user = args.user if args.user else user
-    password = args.password if args.password else password
-    q = args.command if args.command else q
-    name = args.name if args.name else name
-
-    client_class = getattr(main, type_str)
-    client = client_class(host, port, user, password, name)
-    client.connect()
-    result = client.run(q)
-    print(result)
-""")
-        print(f"Script generated: {script_name}.py")
-
-
-class Sqlserver(Database):
-    def __init__(self, host, port, user, password, name):
-        super().__init__(host, port, user, password)
-        self.name = name
-        self.type = 'Sqlserver'
-
-    def connect(self):
-        connection = pymssql.connect(server=self.host, port=self.port, user=self.user, password=self.password, database=self.name)
-        self.cursor = connection.cursor()
-
-    def generate_script(self, raw_input, script_name):
-        with open(f"{script_name}.py", "w") as f:
-            f.write(f"""import main
-import argparse
-
-q = '{raw_input}'
-type_str = '{self.type}'
-host = '{self.host}'
-port = {self.port}
-user = '{self.user}'
-password = '{self.password}'
-name = '{self.name}'
+from flask import Flask, Response, after_this_request, request, jsonify, render_template
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='Command runner')
-    parser.add_argument('-t', '--type', type=str)
-    parser.add_argument('-ho', '--host', type=str)
-    parser.add_argument('-po', '--port', type=int)
-    parser.add_argument('-u', '--user', type=str)
-    parser.add_argument('-pa', '--password', type=str)
-    parser.add_argument('-c', '--command', type=str)
-    parser.add_argument('-n', '--name', type=str)
-    
-    args = parser.parse_args()
-
-    type_str = args.type if args.type else type_str
-    host = args.host if args.host else host
-    port = args.port if args.port else port
-    user = args.user if args.user else user
-    password = args.password if args.password else password
-    q = args.command if args.command else q
-    name = args.name if args.name else name
-
-    client_class = getattr(main, type_str)
-    client = client_class(host, port, user, password, name)
-    client.connect()
-    result = client.run(q)
-    print(result)
-""")
-        print(f"Script generated: {script_name}.py")
+import admission
+import aio
+import batch
+import cache
+import export
+import extract
+import federate
+import metrics
+import registry
+import topology
+import watermark
+from main import Client, Database, Linux, create_client
 
 
 app = Flask(__name__)
 
+# each gunicorn worker imports this module, so each warms its own pools
+registry.load_from_env()
+
+
+def flag(data, key):
+    return str(data.get(key, '')).lower() in ('1', 'true', 'yes', 'on')
+
+
+def wants_stream(data):
+    if flag(data, 'stream'):
+        return True
+    return request.accept_mimetypes.best == 'application/x-ndjson'
+
+
+def wants_events():
+    return request.accept_mimetypes.best == 'text/event-stream'
+
+
+def output_stream(stack, events, sse):
+    # stdout/stderr chunks as they arrive, as NDJSON lines or server-sent events
+    def frame(name, value):
+        if sse:
+            return f'event: {name}\ndata: {app.json.dumps(value)}\n\n'
+        return app.json.dumps({name: value}) + '\n'
+
+    try:
+        try:
+            for name, value in events:
+                yield frame(name, value)
+        except Exception as e:
+            yield frame('error', str(e))
+    finally:
+        stack.close()
+
+
+def ndjson_stream(stack, conn, batches):
+    # header frame with the column names, then one line per fetched batch;
+    # the connection goes back to the pool once the client has read it all
+    try:
+        yield app.json.dumps({'columns': [desc[0] for desc in conn.description]}) + '\n'
+        count = 0
+        try:
+            for rows in batches:
+                count += len(rows)
+                yield app.json.dumps({'rows': rows}) + '\n'
+        except Exception as e:
+            yield app.json.dumps({'error': str(e), 'count': count}) + '\n'
+            return
+        yield app.json.dumps({'count': count}) + '\n'
+    finally:
+        stack.close()
+
+def admit(data, client, slots=1):
+    # holds a slot on the target's gate until the response is closed, so a
+    # streamed result counts against the limit until its last byte is sent
+    entry = registry.targets.get(data['target']) if data.get('target') and registry.targets else {}
+    gate = admission.gate_for(client, entry)
+    ticket = gate.enter(slots)
+
+    @after_this_request
+    def release(response):
+        response.call_on_close(lambda: gate.leave(ticket))
+        return response
+
+    # never more than the target's limit, however many were asked for
+    return ticket[1]
+
+
+def rejected(e):
+    return jsonify({'error': str(e), 'retry_after': e.retry_after}), 429, {'Retry-After': str(e.retry_after)}
+
+
+def relay(stack, chunks):
+    try:
+        yield from chunks
+    finally:
+        stack.close()
+
 @app.route('/', methods=['GET'])
 def index():
     return render_template('index.html')
@@ -223,7 +104,7 @@ def index():
 @app.route('/run_command', methods=['POST'])
 def run_command():
     try:
-        data = request.form if request.form else request.json
+        data = registry.resolve(request.form if request.form else request.json)
         cmd_type = data.get('type')
         host = data.get('host')
         port = int(data.get('port'))
@@ -231,34 +112,200 @@ def run_command():
         password = data.get('password')
         name = data.get('name', '')  # Default to empty string if not provided
         command = data.get('command')
+        params = data.get('params')
+        if isinstance(params, str):
+            params = json.loads(params) if params else None
         file = data.get('file')
 
-        object = None
-        if cmd_type == 'mysql':
-            object = Mysql(host, port, user, password)
-        elif cmd_type == 'oracle':
-            object = Oracle(host, port, user, password, name)
-        elif cmd_type == 'sqlserver':
-            object = Sqlserver(host, port, user, password, name)
-        elif cmd_type == 'windows':
-            object = Windows(host, port, user, password)
-        elif cmd_type == 'linux':
-            object = Linux(host, port, user, password)
-
+        object = create_client(cmd_type, host, port, user, password, name,
+                               topology.parse_replicas(data.get('replicas')), flag(data, 'read_only'))
         if not object:
             return jsonify({'error': 'Invalid type'}), 400
-
-        object.connect()
-        result = object.run(command)
+        admit(data, object)
+
+        batch_size = int(data.get('batch_size') or 0) or None
+        if isinstance(object, Database) and (data.get('rows') is not None or data.get('script')):
+            with object.borrow() as conn:
+                if data.get('script'):
+                    result = conn.run_script(data['script'])
+                else:
+                    result = conn.run_bulk(command, data['rows'], batch_size)
+            return jsonify({'result': result})
+
+        if data.get('format') and isinstance(object, Database):
+            encoding = export.negotiate(request.headers.get('Accept-Encoding'))
+            with ExitStack() as stack:
+                conn = stack.enter_context(object.borrow())
+                batches = conn.stream(command, batch_size, params)
+                chunks = export.export(data['format'], [desc[0] for desc in conn.description], batches, encoding)
+                if file:
+                    object.generate_script(command, file, params)
+                headers = {'Vary': 'Accept-Encoding'}
+                if encoding:
+                    headers['Content-Encoding'] = encoding
+                return Response(relay(stack.pop_all(), chunks), mimetype=export.FORMATS[data['format']], headers=headers)
+
+        if wants_stream(data) and isinstance(object, Database):
+            with ExitStack() as stack:
+                conn = stack.enter_context(object.borrow())
+                batches = conn.stream(command, batch_size, params)
+                if file:
+                    object.generate_script(command, file, params)
+                return Response(ndjson_stream(stack.pop_all(), conn, batches), mimetype='application/x-ndjson')
+
+        if (wants_stream(data) or wants_events()) and isinstance(object, Client):
+            max_bytes = int(data.get('max_bytes') or 0) or None
+            sse = wants_events()
+            with ExitStack() as stack:
+                conn = stack.enter_context(object.borrow())
+                events = conn.stream(command, max_bytes)
+                if file:
+                    object.generate_script(command, file, params)
+                return Response(output_stream(stack.pop_all(), events, sse),
+                                mimetype='text/event-stream' if sse else 'application/x-ndjson',
+                                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+        if flag(data, 'columnar') and isinstance(object, Database):
+            with object.borrow() as conn:
+                result = conn.run_columnar(command, params, batch_size)
+            if data.get('page_size'):
+                result = result.page(int(data.get('page') or 0), int(data['page_size']))
+            if file:
+                object.generate_script(command, file, params)
+            return Response(result.iter_json(), mimetype='application/json')
+
+        if data.get('watermark') and isinstance(object, Database):
+            result = watermark.poll(object, command, data['watermark'], params)
+        elif flag(data, 'cache') or flag(data, 'refresh'):
+            ttl = float(data['cache_ttl']) if data.get('cache_ttl') else None
+            result = cache.results.run(object, command, ttl, flag(data, 'refresh'), params)
+        else:
+            with object.borrow() as conn:
+                if isinstance(command, list) and isinstance(object, Linux):
+                    result = conn.run_many(command)
+                elif params is not None:
+                    result = conn.run(command, params)
+                else:
+                    result = conn.run(command)
 
         if file:
-            object.generate_script(command, file)
+            object.generate_script(command, file, params, data.get('watermark'))
+
+        with metrics.timed('serialize', object.type, object.host):
+            return jsonify({'result': result})
+
+    except admission.Rejected as e:
+        return rejected(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    if registry.targets is None:
+        return jsonify({'ready': True, 'targets': {}})
+    report = registry.targets.report()
+    return jsonify(report), 200 if report['ready'] else 503
+
+@app.route('/cache', methods=['GET'])
+def cache_stats():
+    return jsonify(cache.results.stats())
+
+@app.route('/run_command_async', methods=['POST'])
+async def run_command_async():
+    try:
+        data = registry.resolve(request.form if request.form else request.json)
+        # Flask runs every async view in its own event loop, so stay on the
+        # process-wide pools rather than per-loop native driver connections
+        client = aio.create_client(data.get('type'), data.get('host'), int(data.get('port')), data.get('user'),
+                                   data.get('password'), data.get('name', ''), native=False)
+        if not client:
+            return jsonify({'error': 'Invalid type'}), 400
+        admit(data, client.client)
+
+        async with client:
+            result = await client.run(data.get('command'))
 
         return jsonify({'result': result})
 
+    except admission.Rejected as e:
+        return rejected(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+@app.route('/run_batch', methods=['POST'])
+def run_batch():
+    try:
+        data = request.json
+        targets = data.get('targets') or batch.load_inventory(data['inventory'])
+        command = data.get('command')
+        concurrency = int(data.get('concurrency', 10))
+        timeout = float(data.get('timeout', 60))
+
+        def generate():
+            for record in batch.run_batch(targets, command, concurrency, timeout):
+                yield app.json.dumps(record) + '\n'
+
+        return Response(generate(), mimetype='application/x-ndjson')
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/run_federated', methods=['POST'])
+def run_federated():
+    try:
+        data = request.json
+        targets = data.get('targets') or batch.load_inventory(data['inventory'])
+        limit = int(data['limit']) if data.get('limit') else None
+        records = federate.run_federated(targets, data.get('command'), int(data.get('concurrency', 10)), data.get('sort'),
+                                         limit, data.get('group_by'), data.get('aggregates'), data.get('aliases'),
+                                         int(data.get('batch_size') or 0) or None)
+
+        def generate():
+            for kind, record in records:
+                yield app.json.dumps({kind: record}) + '\n'
+
+        return Response(generate(), mimetype='application/x-ndjson')
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/extract', methods=['POST'])
+def extract_table():
+    try:
+        data = registry.resolve(request.json)
+        client = create_client(data.get('type'), data.get('host'), int(data.get('port')), data.get('user'),
+                               data.get('password'), data.get('name', ''))
+        if not client:
+            return jsonify({'error': 'Invalid type'}), 400
+        # one slot per connection the extraction opens, and no more
+        # connections than the slots it was granted
+        parallel = admit(data, client, int(data.get('parallel', 4)))
+        extraction = extract.Extraction(client, data.get('table'), data.get('key'), data.get('columns'),
+                                        int(data.get('partitions') or 0) or None, parallel,
+                                        flag(data, 'ordered'), flag(data, 'rowid'), int(data.get('batch_size') or 0) or None)
+        output = data.get('format', 'ndjson')
+        encoding = export.negotiate(request.headers.get('Accept-Encoding'))
+        headers = {'Vary': 'Accept-Encoding', 'X-Extraction-Id': extraction.id}
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        return Response(extraction.export(output, encoding), mimetype=export.FORMATS[output], headers=headers)
+
+    except admission.Rejected as e:
+        return rejected(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/extract/<extraction_id>', methods=['GET'])
+def extract_progress(extraction_id):
+    extraction = extract.get(extraction_id)
+    if extraction is None:
+        return jsonify({'error': 'Unknown extraction'}), 404
+    return jsonify(extraction.report())
+
 if __name__ == '__main__':
     app.run(debug=True)
 
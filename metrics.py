@@ -0,0 +1,97 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+log = logging.getLogger('metrics')
+log_enabled = os.environ.get('METRICS_LOG', '') in ('1', 'true', 'yes')
+
+
+class Registry:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        # (phase, backend, host) -> [count per bucket..., +Inf count, sum]
+        self.histograms = {}
+        # (name, backend, host) -> total
+        self.counters = {}
+        # callables returning extra exposition lines (pool, cache, ...)
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def observe(self, phase, backend, host, seconds):
+        key = (phase, backend, str(host))
+        with self.lock:
+            values = self.histograms.get(key)
+            if values is None:
+                values = self.histograms[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    values[index] += 1
+            values[-2] += 1
+            values[-1] += seconds
+        if log_enabled:
+            log.info(json.dumps({'phase': phase, 'backend': backend, 'host': host, 'seconds': round(seconds, 6)}))
+
+    def count(self, name, backend, host, amount=1):
+        key = (name, backend, str(host))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def render(self):
+        lines = ['# HELP remote_phase_seconds Time spent per phase of a remote call',
+                 '# TYPE remote_phase_seconds histogram']
+        with self.lock:
+            histograms = {key: list(values) for key, values in self.histograms.items()}
+            counters = dict(self.counters)
+        for (phase, backend, host), values in sorted(histograms.items()):
+            labels = f'phase="{escape(phase)}",backend="{escape(backend)}",host="{escape(host)}"'
+            for bound, value in zip(self.buckets, values):
+                lines.append(f'remote_phase_seconds_bucket{{{labels},le="{bound}"}} {value}')
+            lines.append(f'remote_phase_seconds_bucket{{{labels},le="+Inf"}} {values[-2]}')
+            lines.append(f'remote_phase_seconds_sum{{{labels}}} {values[-1]}')
+            lines.append(f'remote_phase_seconds_count{{{labels}}} {values[-2]}')
+        for name in sorted({key[0] for key in counters}):
+            lines.append(f'# TYPE remote_{name}_total counter')
+            for (counter, backend, host), value in sorted(counters.items()):
+                if counter == name:
+                    lines.append(f'remote_{name}_total{{backend="{escape(backend)}",host="{escape(host)}"}} {value}')
+        for collector in self.collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+
+
+@contextmanager
+def timed(phase, backend, host):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(phase, backend, host, time.perf_counter() - started)
+
+
+def count(name, backend, host, amount=1):
+    registry.count(name, backend, host, amount)
+
+
+def resolve(backend, host, port):
+    # timed as its own phase, and the address is what the driver connects
+    # to, so connect covers TCP and auth without a second lookup
+    with timed('dns', backend, host):
+        try:
+            return socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0][4][0]
+        except (OSError, UnicodeError):
+            # left to the driver, which reports the failure its own way
+            return host
@@ -0,0 +1,208 @@
+import atexit
+import copy
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+
+DEFAULTS = {
+    'min_size': 0,
+    'max_size': 5,
+    'idle_timeout': 300,
+    'timeout': 30,
+}
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PoolClosed(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, factory, min_size=0, max_size=5, idle_timeout=300, timeout=30):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError(f"invalid pool size: min={min_size} max={max_size}")
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        # (connection, last returned) pairs, oldest first; borrowed from the end
+        self.idle = []
+        self.size = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def open(self):
+        obj = self.factory()
+        obj.address = metrics.resolve(obj.type, obj.host, obj.port)
+        with metrics.timed('connect', obj.type, obj.host):
+            obj.connect()
+        return obj
+
+    def fill(self):
+        while True:
+            with self.condition:
+                if self.closed or self.size >= self.min_size:
+                    return
+                self.size += 1
+            try:
+                obj = self.open()
+            except Exception:
+                self.forget()
+                raise
+            with self.condition:
+                self.idle.append((obj, time.monotonic()))
+                self.condition.notify()
+
+    def acquire(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            obj = None
+            grow = False
+            with self.condition:
+                if self.closed:
+                    raise PoolClosed("pool is closed")
+                expired = self.expire()
+                if self.idle:
+                    obj, _ = self.idle.pop()
+                elif self.size < self.max_size:
+                    self.size += 1
+                    grow = True
+                elif not expired:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f"no connection available after {timeout}s ({self.size} in use)")
+                    self.condition.wait(remaining)
+            for stale in expired:
+                self.discard(stale)
+            if grow:
+                try:
+                    return self.open()
+                except Exception:
+                    self.forget()
+                    raise
+            if obj is not None:
+                if obj.ping():
+                    return obj
+                self.discard(obj)
+
+    def release(self, obj, discard=False):
+        if not discard:
+            try:
+                obj.reset()
+            except Exception:
+                discard = True
+        with self.condition:
+            if not discard and not self.closed:
+                self.idle.append((obj, time.monotonic()))
+                self.condition.notify()
+                return
+        self.discard(obj)
+
+    def expire(self):
+        # caller holds the lock; never shrinks the pool below min_size
+        now = time.monotonic()
+        expired = []
+        while self.idle and self.size - len(expired) > self.min_size:
+            obj, last_used = self.idle[0]
+            if now - last_used < self.idle_timeout:
+                break
+            self.idle.pop(0)
+            expired.append(obj)
+        return expired
+
+    def discard(self, obj):
+        try:
+            obj.close()
+        except Exception:
+            pass
+        self.forget()
+
+    def forget(self):
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.condition.notify_all()
+        for obj, _ in idle:
+            self.discard(obj)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        obj = self.acquire(timeout)
+        try:
+            yield obj
+        finally:
+            self.release(obj)
+
+
+_pools = {}
+_lock = threading.Lock()
+
+
+def fingerprint(password):
+    return hashlib.sha256(str(password).encode()).hexdigest()
+
+
+def get_pool(client, **options):
+    # the password is part of the lookup so a caller can never borrow a
+    # connection that was authenticated with someone else's credentials
+    key = (client.key(), fingerprint(client.password))
+    with _lock:
+        pool = _pools.get(key)
+        if pool is None or pool.closed:
+            template = copy.copy(client)
+            settings = dict(DEFAULTS, **options)
+            settings['max_size'] = max(settings['max_size'], settings['min_size'])
+            pool = _pools[key] = ConnectionPool(lambda: copy.copy(template), **settings)
+        else:
+            # a caller needing more connections at once (a parallel
+            # extraction) or kept open (warm-up) grows a pool someone else
+            # created; the extra connections are opened by fill() below
+            with pool.condition:
+                pool.min_size = max(pool.min_size, options.get('min_size', 0))
+                pool.max_size = max(pool.max_size, options.get('max_size', 0), pool.min_size)
+                pool.condition.notify_all()
+    pool.fill()
+    return pool
+
+
+def pools():
+    with _lock:
+        return dict(_pools)
+
+
+def metrics_lines():
+    lines = ['# TYPE pool_connections gauge']
+    for (key, _), pool in pools().items():
+        labels = f'backend="{metrics.escape(key[0])}",host="{metrics.escape(key[1])}"'
+        with pool.condition:
+            size, idle = pool.size, len(pool.idle)
+        lines.append(f'pool_connections{{{labels},state="idle"}} {idle}')
+        lines.append(f'pool_connections{{{labels},state="in_use"}} {size - idle}')
+    return lines
+
+
+def close_all():
+    with _lock:
+        closing = list(_pools.values())
+        _pools.clear()
+    for pool in closing:
+        pool.close()
+
+
+metrics.registry.collectors.append(metrics_lines)
+
+atexit.register(close_all)
@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import batch
+import metrics
+import sessions
+import topology
+from main import Database, Linux, Windows, create_client
+
+
+WARM_INTERVAL = 60
+FIELDS = ('type', 'host', 'port', 'user', 'password', 'name', 'replicas', 'read_only')
+
+
+def target_id(target):
+    if target.get('id'):
+        return str(target['id'])
+    target_id = f"{str(target['type']).lower()}:{target['host']}:{target['port']}"
+    return f"{target_id}/{target['name']}" if target.get('name') else target_id
+
+
+class TargetRegistry:
+    def __init__(self, targets, min_size=1, concurrency=8, interval=WARM_INTERVAL):
+        self.targets = {target_id(target): target for target in targets}
+        self.min_size = min_size
+        self.concurrency = concurrency
+        # re-warming more often than the pool/session idle timeouts keeps
+        # the connections open while traffic is quiet
+        self.interval = interval
+        self.status = {key: {'state': 'pending'} for key in self.targets}
+        self.warmed = threading.Event()
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def get(self, key):
+        target = self.targets.get(key)
+        if target is None:
+            raise ValueError(f"unknown target: {key}")
+        return target
+
+    def client(self, key):
+        target = self.get(key)
+        client = create_client(target['type'], target['host'], target['port'], target.get('user'), target.get('password'),
+                               target.get('name', ''), topology.parse_replicas(target.get('replicas')),
+                               str(target.get('read_only', '')).lower() in ('1', 'true', 'yes'))
+        if client is None:
+            raise ValueError(f"invalid type: {target['type']}")
+        return client
+
+    def warm_target(self, key):
+        # opens and validates what the first real request would otherwise
+        # have to wait for: pooled connections, SSH transports, WinRM shells
+        started = time.perf_counter()
+        try:
+            client = self.client(key)
+            if isinstance(client, Database):
+                with client.borrow(min_size=int(self.targets[key].get('min_size', self.min_size))) as conn:
+                    if not conn.ping():
+                        raise ValueError("ping failed")
+            elif isinstance(client, Linux):
+                with client.borrow() as conn:
+                    if not conn.connection.is_active():
+                        raise ValueError("transport is not active")
+            elif isinstance(client, Windows):
+                with client.borrow():
+                    shell_id = sessions.wsman.take_shell(client.host, client.port, client.user, client.password)
+                    sessions.wsman.give_shell(client.host, client.port, client.user, client.password, shell_id)
+            status = {'state': 'ready'}
+        except Exception as e:
+            status = {'state': 'failed', 'error': str(e)}
+        status['seconds'] = time.perf_counter() - started
+        status['checked'] = time.time()
+        with self.lock:
+            self.status[key] = status
+
+    def warm_all(self):
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='warm') as executor:
+            list(executor.map(self.warm_target, self.targets))
+        self.warmed.set()
+
+    def run(self):
+        while not self.stopping.is_set():
+            self.warm_all()
+            self.stopping.wait(self.interval)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='warm-up', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+
+    def ready(self):
+        # ready once every target has been tried; a target that is down is
+        # reported but does not keep the whole worker out of rotation
+        return self.warmed.is_set()
+
+    def report(self):
+        with self.lock:
+            status = {key: dict(value) for key, value in self.status.items()}
+        return {'ready': self.ready(), 'targets': status}
+
+    def metrics_lines(self):
+        lines = ['# TYPE target_ready gauge']
+        with self.lock:
+            status = dict(self.status)
+        for key, value in sorted(status.items()):
+            lines.append(f'target_ready{{target="{metrics.escape(key)}"}} {int(value["state"] == "ready")}')
+        return lines
+
+
+targets = None
+
+
+def load(path, **options):
+    global targets
+    if targets is not None:
+        targets.stop()
+        metrics.registry.collectors.remove(targets.metrics_lines)
+    targets = TargetRegistry(batch.load_inventory(path), **options)
+    metrics.registry.collectors.append(targets.metrics_lines)
+    return targets
+
+
+def load_from_env():
+    # TARGETS=path/to/targets.json, warmed with TARGETS_MIN_SIZE connections each
+    path = os.environ.get('TARGETS')
+    if not path:
+        return None
+    return load(path, min_size=int(os.environ.get('TARGETS_MIN_SIZE', 1))).start()
+
+
+def resolve(data):
+    # request fields naming a registered target ('target': id) are filled in
+    # from the registry; anything given explicitly wins
+    data = data.to_dict() if hasattr(data, 'to_dict') else dict(data or {})
+    if not data.get('target'):
+        return data
+    if targets is None:
+        raise ValueError("no target registry is loaded")
+    entry = targets.get(data['target'])
+    for field in FIELDS:
+        if data.get(field) in (None, '') and entry.get(field) not in (None, ''):
+            data[field] = entry[field]
+    return data
@@ -0,0 +1,32 @@
+import argparse
+import json
+
+import batch
+
+
+def load_jobs(path):
+    # a job file holds one job spec or a list of them
+    with open(path) as f:
+        jobs = json.load(f)
+    if isinstance(jobs, dict):
+        jobs = [jobs]
+    for index, job in enumerate(jobs):
+        job.setdefault('job', path if len(jobs) == 1 else f'{path}[{index}]')
+        job['port'] = int(job['port'])
+    return jobs
+
+
+def run_jobs(paths, concurrency=10, timeout=60):
+    jobs = [job for path in paths for job in load_jobs(path)]
+    return batch.run_batch(jobs, None, concurrency, timeout)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run saved job specs')
+    parser.add_argument('jobs', nargs='+', help='Job spec JSON files')
+    parser.add_argument('--concurrency', type=int, default=10, help='Jobs run at once')
+    parser.add_argument('--timeout', type=float, default=60, help='Per-job timeout in seconds')
+    args = parser.parse_args()
+
+    for record in run_jobs(args.jobs, args.concurrency, args.timeout):
+        print(record)
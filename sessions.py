@@ -0,0 +1,203 @@
+import atexit
+import socket
+import threading
+import time
+
+import drivers
+import metrics
+from pool import fingerprint
+
+
+class SessionCache:
+    backend = None
+    resolve = True
+
+    def __init__(self, idle_timeout=300):
+        self.idle_timeout = idle_timeout
+        # key -> {'session', 'last_used', 'users', 'lock', ...}
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def key(self, host, port, user, password):
+        return (host, port, user, fingerprint(password))
+
+    def new_entry(self):
+        return {'session': None, 'last_used': time.monotonic(), 'users': 0, 'lock': threading.Lock()}
+
+    def entry(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = self.new_entry()
+            entry['users'] += 1
+            return entry
+
+    def lookup(self, host, port, user, password):
+        with self.lock:
+            return self.entries.get(self.key(host, port, user, password))
+
+    def acquire(self, host, port, user, password):
+        self.evict_idle()
+        entry = self.entry(self.key(host, port, user, password))
+        try:
+            # one handshake per host even when many threads ask at once
+            with entry['lock']:
+                if entry['session'] is None or not self.is_alive(entry):
+                    self.close_entry(entry)
+                    if self.resolve:
+                        entry['address'] = metrics.resolve(self.backend, host, port)
+                    with metrics.timed('connect', self.backend, host):
+                        self.open(entry, host, port, user, password)
+                entry['last_used'] = time.monotonic()
+                return entry['session']
+        except Exception:
+            self.release(host, port, user, password)
+            raise
+
+    def release(self, host, port, user, password):
+        with self.lock:
+            entry = self.entries.get(self.key(host, port, user, password))
+            if entry is not None:
+                entry['users'] -= 1
+                entry['last_used'] = time.monotonic()
+
+    def discard(self, host, port, user, password):
+        entry = self.lookup(host, port, user, password)
+        if entry is not None:
+            with entry['lock']:
+                self.close_entry(entry)
+
+    def evict_idle(self):
+        now = time.monotonic()
+        with self.lock:
+            idle = [key for key, entry in self.entries.items()
+                    if entry['users'] <= 0 and now - entry['last_used'] >= self.idle_timeout]
+            evicted = [self.entries.pop(key) for key in idle]
+        for entry in evicted:
+            self.close_entry(entry)
+
+    def close_all(self):
+        with self.lock:
+            entries = list(self.entries.values())
+            self.entries.clear()
+        for entry in entries:
+            self.close_entry(entry)
+
+    def is_alive(self, entry):
+        return True
+
+    def open(self, entry, host, port, user, password):
+        raise ValueError
+
+    def close_entry(self, entry):
+        entry['session'] = None
+
+
+class SSHSessionCache(SessionCache):
+    backend = 'Linux'
+
+    def __init__(self, keepalive=30, idle_timeout=300, timeout=10):
+        super().__init__(idle_timeout)
+        self.keepalive = keepalive
+        self.timeout = timeout
+
+    def is_alive(self, entry):
+        return entry['session'].is_active()
+
+    def open(self, entry, host, port, user, password):
+        paramiko = drivers.load('paramiko')
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        # connected to the address resolved in acquire; host keys stay under the host name
+        sock = socket.create_connection((entry.get('address') or host, port), self.timeout)
+        client.connect(hostname=host, port=port, username=user, password=password, timeout=self.timeout, sock=sock)
+        transport = client.get_transport()
+        transport.set_keepalive(self.keepalive)
+        # small exec/window packets otherwise wait on delayed ACKs (~40ms a command)
+        transport.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        entry['client'] = client
+        entry['session'] = transport
+
+    def close_entry(self, entry):
+        client = entry.pop('client', None)
+        entry['session'] = None
+        if client is not None:
+            client.close()
+
+
+class WinRMSessionCache(SessionCache):
+    backend = 'Windows'
+    # the URL keeps the host name for TLS and Kerberos, so the lookup stays
+    # inside requests and is part of the first command's time
+    resolve = False
+
+    def __init__(self, idle_timeout=300, max_shells=5):
+        super().__init__(idle_timeout)
+        self.max_shells = max_shells
+
+    def new_entry(self):
+        entry = super().new_entry()
+        entry['shells'] = []
+        entry['shell_count'] = 0
+        entry['shell_ready'] = threading.Condition()
+        return entry
+
+    def open(self, entry, host, port, user, password):
+        # the protocol keeps one requests.Session, so HTTP connections to the
+        # host are kept alive between commands
+        winrm = drivers.load('winrm')
+        entry['session'] = winrm.Session(f'http://{host}:{port}/wsman', auth=(f'{user}', f'{password}'))
+
+    def take_shell(self, host, port, user, password):
+        entry = self.lookup(host, port, user, password)
+        with entry['shell_ready']:
+            while not entry['shells'] and entry['shell_count'] >= self.max_shells:
+                entry['shell_ready'].wait()
+            if entry['shells']:
+                return entry['shells'].pop()
+            entry['shell_count'] += 1
+        try:
+            # idle_timeout lets the server reap shells we never got to close;
+            # WS-Management wants it as an xs:duration, not bare seconds
+            return entry['session'].protocol.open_shell(idle_timeout=f'PT{int(self.idle_timeout)}S')
+        except Exception:
+            self.drop_shell(entry)
+            raise
+
+    def give_shell(self, host, port, user, password, shell_id, discard=False):
+        entry = self.lookup(host, port, user, password)
+        if entry is None or entry['session'] is None:
+            return
+        if discard:
+            self.close_shell(entry, shell_id)
+            return
+        with entry['shell_ready']:
+            entry['shells'].append(shell_id)
+            entry['shell_ready'].notify()
+
+    def close_shell(self, entry, shell_id):
+        try:
+            entry['session'].protocol.close_shell(shell_id)
+        except Exception:
+            pass
+        self.drop_shell(entry)
+
+    def drop_shell(self, entry):
+        with entry['shell_ready']:
+            entry['shell_count'] -= 1
+            entry['shell_ready'].notify()
+
+    def close_entry(self, entry):
+        with entry['shell_ready']:
+            shells, entry['shells'] = entry['shells'], []
+        if entry['session'] is not None:
+            for shell_id in shells:
+                self.close_shell(entry, shell_id)
+        super().close_entry(entry)
+
+
+ssh = SSHSessionCache()
+wsman = WinRMSessionCache()
+
+atexit.register(ssh.close_all)
+atexit.register(wsman.close_all)
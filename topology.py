@@ -0,0 +1,185 @@
+import json
+import re
+import threading
+import time
+
+import metrics
+import pool
+
+
+# every replica of the availability group(s) holding the client's database,
+# or of all groups when no database is given; only complete on the primary
+DISCOVERY = """
+SELECT ar.replica_server_name, ars.role_desc, ar.secondary_role_allow_connections_desc,
+       ars.connected_state_desc, ars.synchronization_health_desc, ar.read_only_routing_url
+FROM sys.availability_replicas ar
+JOIN sys.dm_hadr_availability_replica_states ars ON ars.replica_id = ar.replica_id
+WHERE %s = '' OR ar.group_id IN (SELECT group_id FROM sys.availability_databases_cluster WHERE database_name = %s)
+"""
+
+LOAD = """
+SELECT COUNT(*) FROM sys.dm_exec_requests
+WHERE session_id <> @@SPID AND status IN ('running', 'runnable', 'suspended')
+"""
+
+REFRESH_INTERVAL = 30
+
+
+def parse_address(address, default_port):
+    # 'host', 'host:port', 'HOST\\INSTANCE' or 'TCP://host:port'
+    address = address.split('://', 1)[-1].split('\\', 1)[0].rstrip('/')
+    host, _, port = address.partition(':')
+    return host, int(port) if port else default_port
+
+
+def parse_replicas(value):
+    # JSON list/object, or 'host[:port]' entries separated by commas or spaces
+    if not value or isinstance(value, (list, dict)):
+        return value or None
+    value = value.strip()
+    if value.startswith(('[', '{')):
+        return json.loads(value)
+    return [replica for replica in re.split(r'[\s,;]+', value) if replica]
+
+
+class Topology:
+    def __init__(self, seeds, refresh_interval=REFRESH_INTERVAL):
+        self.seeds = seeds
+        self.refresh_interval = refresh_interval
+        self.primary = None
+        # readable secondary address -> active requests at the last refresh
+        self.secondaries = {}
+        # address -> requests this process has in flight there
+        self.inflight = {}
+        self.refreshed = 0
+        self.lock = threading.Lock()
+        self.refreshing = threading.Lock()
+
+    def stale(self):
+        return self.primary is None or time.monotonic() - self.refreshed > self.refresh_interval
+
+    def refresh(self, client):
+        errors = []
+        for seed in self.seeds:
+            try:
+                rows = self.discover(client, seed)
+            except Exception as e:
+                errors.append(f'{seed[0]}:{seed[1]}: {e}')
+                continue
+            primary = None
+            secondaries = {}
+            for name, role, allow, connected, health, routing_url in rows:
+                address = client.replica_address(name, routing_url)
+                if role == 'PRIMARY':
+                    primary = address
+                elif role == 'SECONDARY' and allow in ('READ_ONLY', 'ALL') and connected == 'CONNECTED' and health == 'HEALTHY':
+                    secondaries[address] = None
+            if primary is None:
+                # a secondary only knows its own state; try the next seed
+                errors.append(f'{seed[0]}:{seed[1]}: no primary replica reported')
+                continue
+            for address in list(secondaries):
+                secondaries[address] = self.measure(client, address)
+                if secondaries[address] is None:
+                    del secondaries[address]
+            with self.lock:
+                self.primary = primary
+                self.secondaries = secondaries
+                self.refreshed = time.monotonic()
+            return
+        raise ValueError(f"no availability group replica answered: {'; '.join(errors)}")
+
+    def discover(self, client, seed):
+        # a fresh connection each time: a pooled one made through the listener
+        # would still point at the old primary after a failover
+        probe = client.replica(*seed)
+        probe.connect()
+        try:
+            probe.cursor.execute(DISCOVERY, (client.name or '', client.name or ''))
+            return probe.cursor.fetchall()
+        finally:
+            probe.close()
+
+    def measure(self, client, address):
+        # also warms the pool that reads routed to this replica will use
+        try:
+            with client.replica(*address).borrow() as conn:
+                conn.cursor.execute(LOAD)
+                return conn.cursor.fetchone()[0]
+        except Exception:
+            return None
+
+    def choose(self, read_only):
+        with self.lock:
+            if read_only and self.secondaries:
+                address = min(self.secondaries, key=lambda secondary: self.secondaries[secondary] + self.inflight.get(secondary, 0))
+            else:
+                address = self.primary
+            self.inflight[address] = self.inflight.get(address, 0) + 1
+        return address
+
+    def done(self, address):
+        with self.lock:
+            self.inflight[address] -= 1
+
+
+_topologies = {}
+_lock = threading.Lock()
+
+
+def key(client):
+    return (client.host, client.port, client.name, client.user, pool.fingerprint(client.password))
+
+
+def get(client, force=False):
+    with _lock:
+        topology = _topologies.get(key(client))
+        if topology is None:
+            topology = _topologies[key(client)] = Topology(client.seeds(), client.refresh_interval)
+    if force or topology.stale():
+        # one caller refreshes; the rest keep routing on the previous view
+        # unless there is none yet
+        blocking = force or topology.primary is None
+        if topology.refreshing.acquire(blocking=blocking):
+            try:
+                if force or topology.stale():
+                    topology.refresh(client)
+            except Exception:
+                if force or topology.primary is None:
+                    raise
+                # keep routing on the last good view and retry a bit later
+                with topology.lock:
+                    topology.refreshed = time.monotonic()
+            finally:
+                topology.refreshing.release()
+    return topology
+
+
+def invalidate(client):
+    with _lock:
+        topology = _topologies.get(key(client))
+    if topology is not None:
+        with topology.lock:
+            topology.refreshed = 0
+
+
+def metrics_lines():
+    lines = ['# TYPE sqlserver_replica_requests gauge']
+    with _lock:
+        topologies = dict(_topologies)
+    for (listener, _, name, _, _), topology in topologies.items():
+        with topology.lock:
+            replicas = [(topology.primary, 'primary', None)] + [(address, 'secondary', load) for address, load in topology.secondaries.items()]
+            inflight = dict(topology.inflight)
+        for address, role, load in replicas:
+            if address is None:
+                continue
+            labels = (f'listener="{metrics.escape(listener)}",database="{metrics.escape(name)}",'
+                      f'replica="{metrics.escape(address[0])}:{address[1]}",role="{role}"')
+            if load is not None:
+                lines.append(f'sqlserver_replica_requests{{{labels},source="server"}} {load}')
+            lines.append(f'sqlserver_replica_requests{{{labels},source="local"}} {inflight.get(address, 0)}')
+    return lines
+
+
+metrics.registry.collectors.append(metrics_lines)
@@ -0,0 +1,146 @@
+import datetime
+import decimal
+import hashlib
+import json
+import os
+import threading
+import time
+
+import extract
+
+
+KINDS = ('timestamp', 'rowversion', 'scn', 'number')
+MARKER = '{watermark}'
+STATE_DIR = os.environ.get('WATERMARK_DIR', 'watermarks')
+
+_lock = threading.Lock()
+
+
+def parse_spec(spec):
+    # {"column": ..., "kind": ..., "initial": ..., "lag": seconds} or 'column[:kind]'
+    if isinstance(spec, str):
+        spec = spec.strip()
+        if spec.startswith('{'):
+            spec = json.loads(spec)
+        else:
+            column, _, kind = spec.partition(':')
+            spec = {'column': column, 'kind': kind or 'timestamp'}
+    spec = dict(spec)
+    spec.setdefault('kind', 'timestamp')
+    if spec['kind'] not in KINDS:
+        raise ValueError(f"unknown watermark kind '{spec['kind']}', expected one of: {', '.join(KINDS)}")
+    extract.identifier(spec.get('column'))
+    return spec
+
+
+def encode(kind, value):
+    if value is None:
+        return None
+    if kind == 'rowversion' and isinstance(value, (bytes, bytearray)):
+        return bytes(value).hex()
+    if kind == 'timestamp' and hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if kind in ('scn', 'number') and not isinstance(value, (int, float)):
+        return str(value)
+    return value
+
+
+def decode(kind, stored):
+    if stored is None:
+        return None
+    if kind == 'rowversion':
+        return bytes.fromhex(stored)
+    if kind == 'timestamp' and isinstance(stored, str):
+        return datetime.datetime.fromisoformat(stored)
+    if kind == 'scn':
+        return int(stored)
+    if kind == 'number' and isinstance(stored, str):
+        # DECIMAL values are stored as text to keep their precision
+        try:
+            return int(stored)
+        except ValueError:
+            return decimal.Decimal(stored)
+    return stored
+
+
+def state_path(client, query, column, params=None, state_dir=None):
+    # the bind parameters pick the rows (tenant = %s), so each set keeps its own watermark
+    identity = [client.type, client.host, client.port, getattr(client, 'name', ''), client.user, query, column]
+    if params:
+        identity.append(list(params))
+    identity = json.dumps(identity, default=str)
+    return os.path.join(state_dir or STATE_DIR, hashlib.sha256(identity.encode()).hexdigest()[:32] + '.json')
+
+
+def load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save(path, state):
+    # write then rename, so a crash never leaves a half-written watermark
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=2, default=str)
+    os.replace(tmp, path)
+
+
+def incremental_query(client, query, column, position):
+    # '{watermark}' in the query marks where the bind goes (after any other
+    # positional parameters); otherwise the query is filtered from outside
+    if MARKER in query:
+        return query.replace(MARKER, client.placeholder(position))
+    return f'SELECT * FROM ({query}) w WHERE {column} > {client.placeholder(position)}'
+
+
+def poll(client, query, spec, params=None, state_dir=None):
+    # only rows past the stored watermark are fetched; the watermark moves to
+    # the highest value seen once the whole result has been read
+    spec = parse_spec(spec)
+    column, kind = spec['column'], spec['kind']
+    if isinstance(params, dict):
+        raise ValueError("watermark queries take positional parameters only")
+    path = state_path(client, query, column, params, state_dir)
+    with _lock:
+        state = load(path)
+    previous = state.get('watermark', spec.get('initial'))
+    current = decode(kind, previous)
+    since = current
+    if since is not None and kind == 'timestamp' and spec.get('lag'):
+        # re-reads rows committed late with an earlier timestamp
+        since -= datetime.timedelta(seconds=float(spec['lag']))
+    params = list(params or [])
+    if since is None:
+        if MARKER in query:
+            raise ValueError("a query with '{watermark}' needs an initial watermark for its first run")
+        statement = query
+    else:
+        statement = incremental_query(client, query, column, len(params))
+        params.append(since)
+
+    with client.borrow() as conn:
+        batches = conn.stream(statement, None, params or None)
+        columns = [desc[0] for desc in conn.description]
+        lowered = [name.lower() for name in columns]
+        if column.lower() not in lowered:
+            raise ValueError(f"watermark column '{column}' is not in the result")
+        index = lowered.index(column.lower())
+        rows = []
+        highest = current
+        for batch in batches:
+            rows.extend(batch)
+            for row in batch:
+                value = row[index]
+                if value is not None and (highest is None or value > highest):
+                    highest = value
+
+    watermark = encode(kind, highest) if highest is not current else previous
+    if watermark != previous or not state:
+        with _lock:
+            save(path, {'watermark': watermark, 'column': column, 'kind': kind, 'query': query,
+                        'rows': len(rows), 'updated': time.time()})
+    return {'columns': columns, 'rows': rows, 'count': len(rows), 'previous': previous, 'watermark': watermark}
@@ -0,0 +1,153 @@
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import batch
+import runner
+
+
+DIRS = ('incoming', 'running', 'done', 'failed')
+
+
+def write_json(directory, filename, data):
+    # write then rename, so readers never see a half-written file
+    tmp = os.path.join(directory, f'.{filename}.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=2, default=str)
+    os.replace(tmp, os.path.join(directory, filename))
+
+
+def submit(spool, job):
+    os.makedirs(os.path.join(spool, 'incoming'), exist_ok=True)
+    filename = f"{time.time_ns()}-{os.getpid()}-{threading.get_ident()}.json"
+    write_json(os.path.join(spool, 'incoming'), filename, job)
+    return filename
+
+
+def host_key(job):
+    return (str(job['type']).lower(), job['host'], int(job['port']))
+
+
+class Worker:
+    def __init__(self, spool, concurrency=16, per_host=4, poll=1.0):
+        self.spool = spool
+        for directory in DIRS:
+            os.makedirs(os.path.join(spool, directory), exist_ok=True)
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.poll = poll
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='worker')
+        self.active = {}
+        self.running = 0
+        self.stopping = False
+        self.condition = threading.Condition()
+
+    def path(self, directory, filename):
+        return os.path.join(self.spool, directory, filename)
+
+    def recover(self):
+        # jobs left in running/ by a worker that died; only safe when no
+        # other worker is using this spool
+        for filename in os.listdir(os.path.join(self.spool, 'running')):
+            os.replace(self.path('running', filename), self.path('incoming', filename))
+
+    def poll_once(self):
+        dispatched = 0
+        for filename in sorted(os.listdir(os.path.join(self.spool, 'incoming'))):
+            if filename.startswith('.') or not filename.endswith('.json'):
+                continue
+            with self.condition:
+                if self.running >= self.concurrency:
+                    break
+            try:
+                with open(self.path('incoming', filename)) as f:
+                    job = json.load(f)
+                job['port'] = int(job['port'])
+                key = host_key(job)
+            except FileNotFoundError:
+                continue
+            except (ValueError, KeyError, TypeError) as e:
+                self.finish('incoming', filename, {'job': filename, 'error': f'invalid job: {e}'}, 'failed')
+                continue
+            with self.condition:
+                if self.active.get(key, 0) >= self.per_host:
+                    continue
+            try:
+                # the rename is the claim; another worker may have won it
+                os.rename(self.path('incoming', filename), self.path('running', filename))
+            except FileNotFoundError:
+                continue
+            with self.condition:
+                self.active[key] = self.active.get(key, 0) + 1
+                self.running += 1
+            job.setdefault('job', filename)
+            self.executor.submit(self.execute, filename, job, key)
+            dispatched += 1
+        return dispatched
+
+    def execute(self, filename, job, key):
+        started = time.monotonic()
+        record = batch.describe(job)
+        try:
+            record['result'] = batch.run_target(job, None)
+            outcome = 'done'
+        except Exception as e:
+            record['error'] = str(e)
+            outcome = 'failed'
+        finally:
+            with self.condition:
+                self.active[key] -= 1
+                self.running -= 1
+                self.condition.notify_all()
+        record['elapsed'] = time.monotonic() - started
+        self.finish('running', filename, record, outcome)
+
+    def finish(self, directory, filename, record, outcome):
+        write_json(os.path.join(self.spool, outcome), filename, record)
+        try:
+            os.remove(self.path(directory, filename))
+        except FileNotFoundError:
+            pass
+
+    def serve(self):
+        try:
+            while not self.stopping:
+                if not self.poll_once():
+                    # a finished job frees a slot, so look again right away
+                    with self.condition:
+                        self.condition.wait(self.poll)
+        finally:
+            self.executor.shutdown(wait=True)
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run saved jobs from a spool directory')
+    parser.add_argument('-s', '--spool', type=str, default='spool', help='Spool directory')
+    parser.add_argument('--concurrency', type=int, default=16, help='Jobs run at once')
+    parser.add_argument('--per-host', type=int, default=4, help='Jobs run at once against one target')
+    parser.add_argument('--poll', type=float, default=1.0, help='Seconds between spool scans when idle')
+    parser.add_argument('--recover', action='store_true', help='Requeue jobs left in running/ by a dead worker')
+    parser.add_argument('--submit', nargs='+', help='Queue these job spec files and exit')
+    args = parser.parse_args()
+
+    if args.submit:
+        for path in args.submit:
+            for job in runner.load_jobs(path):
+                print(submit(args.spool, job))
+        exit()
+
+    worker = Worker(args.spool, args.concurrency, args.per_host, args.poll)
+    if args.recover:
+        worker.recover()
+    try:
+        worker.serve()
+    except KeyboardInterrupt:
+        worker.stop()